@@ -1,52 +1,139 @@
 from prompts.medical_advisor import (
+    COMPACT_FALLBACK_RESPONSE,
+    MEDICAL_ADVISOR_COMPACT_SYSTEM_PROMPT,
     MEDICAL_ADVISOR_SYSTEM_PROMPT,
+    expand_compact_response,
     format_medical_question,
 )
+from utils.index_store import ChunkId, Shard, load_manifest, load_shard, search_shards
+from utils.metrics import stage
+from utils.usage import UsageRecorder
 
+from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
 import os
-import pickle
+import time
 
-import faiss
 import numpy as np
 from openai import OpenAI, embeddings
 from sklearn.preprocessing import normalize
 
+logger = logging.getLogger(__name__)
+
+
 class AI:
     def __init__(self):
         self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        self.index = faiss.read_index("disease_index.faiss")
-        with open("./disease_metadata.pkl", "rb") as f:
-            self.metadata = pickle.load(f)
+        # 有 manifest 時載入其中的各個 shard，否則沿用單一的 disease_index.faiss
+        self.manifest_path = os.getenv("INDEX_MANIFEST", "index_manifest.json")
+        self.shards: dict[str, Shard] = {}
+        self.reload_index()
+        self.search_pool = ThreadPoolExecutor(
+            max_workers=int(os.getenv("INDEX_SEARCH_THREADS", "4")), thread_name_prefix="faiss"
+        )
+        self.prompt_token_budget = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+        # compact: GPT answers with short keys which are expanded here
+        self.response_schema = os.getenv("GPT_RESPONSE_SCHEMA", "compact")
+        self.max_tokens = int(os.getenv("GPT_MAX_TOKENS", "500"))
+        self.model = os.getenv("GPT_MODEL", "gpt-3.5-turbo")
+        self.usage = UsageRecorder(os.getenv("GPT_USAGE_LOG"))
+
+    def reload_index(self, name: str | None = None) -> list[str]:
+        """Load one shard, or every shard, from disk and return the names loaded.
 
-    def generate_gpt_response(self, paragraph: str, question: str) -> str:
+        The other shards keep serving while one is reloaded. Without a
+        manifest the single index is served as the `default` shard.
+        """
+        if os.path.exists(self.manifest_path):
+            entries = load_manifest(self.manifest_path)
+        else:
+            entries = {
+                "default": {"index": "disease_index.faiss", "metadata": "./disease_metadata.pkl"}
+            }
+        if name is not None:
+            if name not in entries:
+                raise KeyError(f"Unknown index shard: {name}")
+            entries = {name: entries[name]}
+
+        shards = dict(self.shards) if name is not None else {}
+        for shard_name, entry in entries.items():
+            shards[shard_name] = load_shard(shard_name, entry["index"], entry["metadata"])
+        self.shards = shards
+        loaded = [f"{shard_name} ({shards[shard_name].index.ntotal} rows)" for shard_name in entries]
+        logger.info("Loaded index shards: %s", ", ".join(loaded))
+        return list(entries)
+
+    @property
+    def system_prompt(self) -> str:
+        if self.response_schema == "compact":
+            return MEDICAL_ADVISOR_COMPACT_SYSTEM_PROMPT
+        return MEDICAL_ADVISOR_SYSTEM_PROMPT
+
+    def generate_gpt_response(
+        self, paragraph: str, question: str, history: list[str] | None = None
+    ) -> str:
         """Generate response using GPT"""
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": MEDICAL_ADVISOR_SYSTEM_PROMPT},
-                    {
-                        "role": "user",
-                        "content": format_medical_question(paragraph, question),
-                    },
-                ],
-                temperature=0.7,
-                max_tokens=500,
-            )
-            return response.choices[0].message.content or ""
+            start = time.perf_counter()
+            with stage("gpt", upstream="openai") as span:
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": self.system_prompt},
+                        {
+                            "role": "user",
+                            "content": format_medical_question(paragraph, question, history),
+                        },
+                    ],
+                    temperature=0.7,
+                    max_tokens=self.max_tokens,
+                    response_format={"type": "json_object"},
+                )
+            usage = self.usage.record(self.model, response.usage, time.perf_counter() - start)
+            span.set("model", self.model)
+            for key in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+                span.set(key, usage[key])
+            content = response.choices[0].message.content or ""
         except Exception as e:
-            logging.error(f"Error generating GPT response: {e}")
+            logger.error("Error generating GPT response: %s", e)
             return "抱歉，我現在無法回答這個問題。"
 
-    def query_faiss(self, question: str, top_k: int = 3) -> list[str]:
-        response = embeddings.create(
-            input=question, model="text-embedding-ada-002"
-        )
-        query_vector = normalize(np.array([response.data[0].embedding]), axis=1)
-        D, I = self.index.search(query_vector, top_k)
+        if self.response_schema != "compact":
+            return content
+        try:
+            return json.dumps(expand_compact_response(json.loads(content)), ensure_ascii=False)
+        except (json.JSONDecodeError, AttributeError) as e:
+            # JSON mode only breaks when the answer is cut off by max_tokens
+            logger.error("Failed to expand compact GPT response: %s", e)
+            return json.dumps(COMPACT_FALLBACK_RESPONSE, ensure_ascii=False)
+
+    def embed(self, question: str) -> np.ndarray:
+        """The normalised embedding of `question` as a 1 x d array"""
+        with stage("embedding", upstream="openai"):
+            response = embeddings.create(
+                input=question, model="text-embedding-ada-002"
+            )
+        return normalize(np.array([response.data[0].embedding]), axis=1)
+
+    def search(self, question: str, top_k: int = 3) -> list[ChunkId]:
+        """Return the (shard, row) ids of the chunks closest to `question`"""
+        query_vector = self.embed(question)
+        with stage("faiss") as span:
+            shards = list(self.shards.values())
+            chunk_ids = search_shards(shards, query_vector, top_k, self.search_pool)
+            span.set("shards", len(shards))
+            span.set("chunk_ids", chunk_ids)
+        return chunk_ids
 
-        results = []
-        for idx in I[0]:
-            results.append(self.metadata[idx]["content"])
-        return results
+    def get_chunks(self, chunk_ids: list[ChunkId]) -> list[tuple[ChunkId, str]]:
+        """(id, content) of each chunk; ids no longer in a reloaded shard are skipped"""
+        shards = self.shards
+        return [
+            ((name, row), shards[name].metadata[row]["content"])
+            for name, row in chunk_ids
+            if name in shards and row < len(shards[name].metadata)
+        ]
+
+    def query_faiss(self, question: str, top_k: int = 3) -> list[str]:
+        return [content for _, content in self.get_chunks(self.search(question, top_k))]
@@ -1,7 +1,9 @@
 from line_bot import Bot
+from utils.logs import setup_logging
 from dotenv import load_dotenv
 
 load_dotenv()
+setup_logging()
 
 bot = Bot()
 bot.run()
\ No newline at end of file
@@ -1,920 +1,444 @@
 from ai import AI
-from utils.flex_message_converter import convert_to_flex_message
-
+from prompts.medical_advisor import fit_prompt_budget
+from utils.asr import SegmentedTranscriber, create_asr_backend
+from utils.audio import AudioDecodePool, audio_seconds
+from utils.audio_admission import EMPTY, REJECT, AudioAdmissionPolicy, AudioTooLarge
+from utils.clinic_index import ClinicIndex
+from utils.flex_templates import FlexTemplateEngine
+from utils.intent_filter import UNRELATED_RESPONSE, IntentFilter
+from utils.line_api import LineAPI, flex_message, text_message
+from utils.logs import payload_sampled, redact, redact_webhook_body
+from utils import metrics, profiling, tracing
+from utils.places import ClinicSearch
+from utils.session_store import SessionStore, Turn, summarize_turn
+from utils.transcription_cache import TranscriptionCache
+
+import hmac
 import json
 import logging
 import os
-import tempfile
+import time
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from linebot.v3 import WebhookHandler
 from linebot.v3.exceptions import InvalidSignatureError
-from linebot.v3.messaging import (
-    Configuration,
-    ApiClient,
-    MessagingApi,
-    ReplyMessageRequest,
-    MessagingApiBlob,
-    TextMessage,
-    FlexMessage,
-    FlexContainer,
-)
 from linebot.v3.webhooks import (
     AudioMessageContent,
     MessageEvent,
     TextMessageContent,
     LocationMessageContent,
 )
-from pydub import AudioSegment
-import requests
-import speech_recognition as sr
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EMPTY_REPLY = "沒有聽到聲音，請再錄一次語音訊息。"
 
 
 class Bot:
     def __init__(self):
         self.app: Flask = Flask(__name__)
-        self.config = Configuration(access_token=os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
+        self.line_api = LineAPI(
+            os.getenv("LINE_CHANNEL_ACCESS_TOKEN"),
+            pool_size=int(os.getenv("LINE_HTTP_POOL_SIZE", "10")),
+            # 僅供除錯：送出前以 SDK 模型驗證 Flex 內容
+            validate=os.getenv("LINE_VALIDATE_FLEX") == "1",
+        )
+        self.audio_decoder = AudioDecodePool(
+            max_workers=int(os.getenv("AUDIO_DECODE_WORKERS", "2")),
+            max_queue=int(os.getenv("AUDIO_DECODE_QUEUE", "16")),
+            silence_db=(
+                None
+                if os.getenv("AUDIO_SILENCE_DB") == "off"
+                else float(os.getenv("AUDIO_SILENCE_DB", "-40"))
+            ),
+        )
+        def transcriber(backend_name: str | None = None) -> SegmentedTranscriber:
+            return SegmentedTranscriber(
+                create_asr_backend(backend_name),
+                parallelism=int(os.getenv("ASR_PARALLELISM", "4")),
+                max_segment_seconds=float(os.getenv("ASR_SEGMENT_SECONDS", "15")),
+                retries=int(os.getenv("ASR_RETRIES", "2")),
+            )
+
+        # 長語音改用 ASR_FAST_BACKEND（未設定則與 ASR_BACKEND 相同）
+        self.asr = transcriber()
+        self.fast_asr = self.asr
+        fast_backend = os.getenv("ASR_FAST_BACKEND")
+        if fast_backend and fast_backend != self.asr.backend.name:
+            self.fast_asr = transcriber(fast_backend)
+        self.asr_language = os.getenv("ASR_LANGUAGE", "zh-Hant")
+        self.audio_admission = AudioAdmissionPolicy(
+            min_ms=int(os.getenv("AUDIO_MIN_DURATION_MS", "500")),
+            max_ms=int(os.getenv("AUDIO_MAX_DURATION_MS", "60000")),
+            oversize=os.getenv("AUDIO_OVERSIZE_ACTION", "trim"),
+            fast_path_ms=int(os.getenv("AUDIO_FAST_PATH_MS", "20000")),
+            max_bytes=int(os.getenv("AUDIO_MAX_BYTES", str(10 * 1024 * 1024))),
+        )
+        self.audio_too_long_reply = (
+            f"語音訊息太長了，請錄製 {self.audio_admission.max_ms // 1000} 秒以內的語音。"
+        )
+        self.transcriptions = TranscriptionCache(
+            max_entries=int(os.getenv("TRANSCRIPTION_CACHE_SIZE", "1024")),
+            path=os.getenv("TRANSCRIPTION_CACHE_PATH"),
+        )
+        self.flex_templates = FlexTemplateEngine()
+        self.admin_token = os.getenv("ADMIN_TOKEN")
+        self.profile_dir = os.getenv("PROFILE_DIR", "profiles")
+        self.profiler = profiling.SamplingProfiler(
+            interval=float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+        )
+        profiling.install_signal_handler(
+            self.profiler, float(os.getenv("PROFILE_SIGNAL_SECONDS", "30")), self.profile_dir
+        )
+        tracing.configure(
+            buffer_size=int(os.getenv("TRACE_BUFFER_SIZE", "500")),
+            otlp_endpoint=os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"),
+        )
+        # 優先查本機診所索引，查不到再視設定改查 Google Places
+        clinic_index_path = os.getenv("CLINIC_INDEX_PATH", "clinics.npz")
+        self.clinic_index = None
+        if os.path.exists(clinic_index_path):
+            self.clinic_index = ClinicIndex.load(clinic_index_path)
+            logger.info("Loaded %d clinics from %s", len(self.clinic_index), clinic_index_path)
+        self.places = None
+        if os.getenv("CLINIC_PLACES_FALLBACK", "1") == "1":
+            self.places = ClinicSearch(
+                os.getenv("GOOGLE_MAPS_API_KEY"),
+                precision=int(os.getenv("CLINIC_CACHE_PRECISION", "6")),
+                ttl_seconds=float(os.getenv("CLINIC_CACHE_TTL_SECONDS", "86400")),
+                max_entries=int(os.getenv("CLINIC_CACHE_SIZE", "1024")),
+            )
         self.handler = WebhookHandler(os.getenv("LINE_CHANNEL_SECRET"))
         self.__init_routes()
 
         self.ai = AI()
+        self.sessions = SessionStore(
+            ttl_seconds=int(os.getenv("SESSION_TTL_SECONDS", "1800")),
+            max_sessions=int(os.getenv("SESSION_MAX_USERS", "1000")),
+            max_turns=int(os.getenv("SESSION_MAX_TURNS", "4")),
+        )
+        self.intent_filter = IntentFilter(
+            model_path=os.getenv("INTENT_MODEL_PATH", "intent_model.pkl"),
+            threshold=float(os.getenv("INTENT_THRESHOLD", "0.9")),
+        )
+        self.unrelated_reply = json.dumps(UNRELATED_RESPONSE, ensure_ascii=False)
+
+    def __answer_question(self, user_id: str | None, question: str) -> str:
+        """Retrieve context and ask GPT, carrying over the user's recent turns"""
+        session = self.sessions.get(user_id) if user_id else None
+
+        # 明顯的閒聊直接回覆，不查 FAISS 也不呼叫 GPT；追問中則一律交給 GPT
+        awaiting_info = session is not None and session.awaiting_info
+        with metrics.stage("intent"):
+            unrelated = not awaiting_info and self.intent_filter.is_unrelated(question)
+        if unrelated:
+            logger.info("Intent filter answered unrelated message locally")
+            return self.unrelated_reply
+
+        # 追問時沿用先前查到的段落，並以前後文一起檢索
+        query = question
+        if awaiting_info:
+            query = f"{session.turns[-1].question}\n{question}"
+        retrieved = self.ai.search(query)
+        chunk_ids = retrieved
+        history = []
+        if session is not None:
+            if awaiting_info:
+                chunk_ids = [i for i in session.chunk_ids() if i not in retrieved] + retrieved
+            history = session.summaries()
+
+        with metrics.stage("prompt") as span:
+            found = self.ai.get_chunks(chunk_ids)
+            chunks, history = fit_prompt_budget(
+                [content for _, content in found],
+                history,
+                question,
+                self.ai.prompt_token_budget,
+                self.ai.system_prompt,
+            )
+            chunk_ids = [chunk_id for chunk_id, _ in found[: len(chunks)]]
+            span.set("chunk_ids", chunk_ids)
+            span.set("history_turns", len(history))
+
+        gpt_response = self.ai.generate_gpt_response(
+            "\n\n".join(chunks), question, history
+        )
+
+        if user_id:
+            # 只記下這一輪新查到的段落，避免前幾輪的段落一路累積下去
+            used = set(chunk_ids)
+            summary, response_type = summarize_turn(question, gpt_response)
+            self.sessions.append(
+                user_id,
+                Turn(
+                    question=question,
+                    summary=summary,
+                    chunk_ids=[i for i in retrieved if i in used],
+                    response_type=response_type,
+                ),
+            )
+        return gpt_response
+
+    def __find_clinics(self, lat: float, lng: float) -> list[dict]:
+        if self.clinic_index is not None:
+            with metrics.stage("clinic_index") as span:
+                clinics = self.clinic_index.nearest(lat, lng)
+                span.set("results", len(clinics))
+            if clinics:
+                return clinics
+        if self.places is not None:
+            return self.places.search(lat, lng)
+        return []
+
+    def __reply_text(self, reply_token: str, text: str):
+        self.line_api.reply(reply_token, [text_message(text)])
+
+    def __reply_answer(self, reply_token: str, gpt_response: str):
+        """Reply with the Flex Message for a GPT response, or as text if it is not JSON"""
+        try:
+            response_data = json.loads(gpt_response)
+        except json.JSONDecodeError as e:
+            logger.error("Failed to parse GPT response as JSON: %s", e)
+            self.__reply_text(reply_token, gpt_response)
+            return
+
+        with metrics.stage("flex"):
+            contents = self.flex_templates.render_response(response_data)
+        self.line_api.reply(reply_token, [flex_message("醫療諮詢回覆", contents)])
+
+    def __is_admin(self, token: str | None) -> bool:
+        return bool(self.admin_token) and hmac.compare_digest(token or "", self.admin_token)
 
     def __init_routes(self):
+        @self.app.before_request
+        def start_request_profile():
+            # 帶有 X-Profile-Token 的請求以 cProfile 記錄，結果檔名放在回應標頭
+            if not self.__is_admin(request.headers.get("X-Profile-Token")):
+                return
+            try:
+                g.profile = profiling.profile_request(
+                    self.profile_dir, request.endpoint or "unknown"
+                )
+            except profiling.ProfilerBusy as e:
+                logger.warning("Not profiling request: %s", e)
+
+        @self.app.after_request
+        def finish_request_profile(response):
+            if "profile" in g:
+                profile, path = g.pop("profile")
+                profiling.finish_request(profile, path)
+                response.headers["X-Profile-File"] = path
+            return response
+
         @self.app.route("/webhook", methods=["POST"])
         def webhook():
             signature = request.headers.get("X-Line-Signature", "")
             body = request.get_data(as_text=True)
-            logging.info("Received webhook request")
-            logging.info(f"Signature: {signature}")
-            logging.debug(f"Request body: {body}")
+            if payload_sampled(logger):
+                logger.debug("Request body: %s", redact_webhook_body(body))
 
             try:
                 self.handler.handle(body, signature)
-                logging.info("Successfully handled webhook request")
             except InvalidSignatureError:
-                logging.error(
+                logger.error(
                     "Invalid signature. Please check your channel access token/channel secret."
                 )
                 return jsonify({"error": "Invalid signature"}), 400
             except Exception as e:
-                logging.error(f"Error handling webhook: {str(e)}")
+                logger.exception("Error handling webhook: %s", e)
                 return jsonify({"error": str(e)}), 500
 
             return "OK"
 
+        @self.app.route("/debug/traces", methods=["GET"])
+        def debug_traces():
+            """The slowest recent events with their spans; needs ADMIN_TOKEN"""
+            token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+            if not self.__is_admin(token):
+                return jsonify({"error": "Not found"}), 404
+            # 非數字的 limit 視為預設值，並限制在緩衝區大小以內
+            limit = request.args.get("limit", 20, type=int)
+            limit = max(0, min(limit, tracing.buffer.size))
+            return jsonify([trace.to_dict() for trace in tracing.buffer.slowest(limit)])
+
+        @self.app.route("/admin/profile", methods=["GET"])
+        def admin_profile():
+            """Sample all threads for `seconds` and return collapsed stacks; needs ADMIN_TOKEN"""
+            token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+            if not self.__is_admin(token):
+                return jsonify({"error": "Not found"}), 404
+            seconds = max(0.0, request.args.get("seconds", 10.0, type=float))
+            try:
+                collapsed = self.profiler.collapsed(seconds)
+            except profiling.ProfilerBusy as e:
+                return jsonify({"error": str(e)}), 409
+            filename = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+            return Response(
+                collapsed,
+                content_type="text/plain; charset=utf-8",
+                headers={"Content-Disposition": f"attachment; filename={filename}"},
+            )
+
+        @self.app.route("/admin/reload-index", methods=["POST"])
+        def admin_reload_index():
+            """Reload one index shard (?shard=name) or all of them; needs ADMIN_TOKEN"""
+            token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+            if not self.__is_admin(token):
+                return jsonify({"error": "Not found"}), 404
+            try:
+                reloaded = self.ai.reload_index(request.args.get("shard"))
+            except KeyError as e:
+                return jsonify({"error": str(e.args[0])}), 400
+            except Exception as e:
+                logger.exception("Failed to reload index: %s", e)
+                return jsonify({"error": str(e)}), 500
+            return jsonify({"reloaded": reloaded})
+
+        @self.app.route("/metrics", methods=["GET"])
+        def prometheus_metrics():
+            body, content_type = metrics.render()
+            return Response(body, content_type=content_type)
+
         @self.handler.add(MessageEvent, message=TextMessageContent)
+        @metrics.tracked("text")
         def handle_text_message(event: MessageEvent):
             """Handle text messages"""
 
-            question = event.message.to_str()
-            logging.info(f"Received text message: {question}")
+            question = event.message.text
+            logger.info("Text message %s, %d chars", event.message.id, len(question))
+            if payload_sampled(logger):
+                logger.debug("Question: %s", redact(question))
 
             if event.reply_token is None:
-                logging.warning("Reply token is None, skipping message")
+                logger.warning("Reply token is None, skipping message")
                 return
 
             try:
-                # 查詢 FAISS
-                context_chunks = self.ai.query_faiss(question)
-                paragraph = "\n\n".join(context_chunks)
-
-                # Generate response using GPT
-                gpt_response = self.ai.generate_gpt_response(paragraph, question)
-                logging.info(f"Generated GPT response: {gpt_response}")
-
-                try:
-                    # Parse GPT response
-                    response_data = json.loads(gpt_response)
-                    logging.info(f"Parsed GPT response data: {response_data}")
-                    
-                    # Create Flex Message based on response type
-                    print(f"gpt_response: {gpt_response}")
-                    print(f"response_data: {response_data}")
-                    if response_data["type"] == "matched":
-                        print("[handle text message] type: matched")
-                        # Ensure text fields are not None or empty
-                        disease_text = str(response_data.get("disease", "無法確定可能的疾病")).strip()
-                        symptoms_list = response_data.get("symptoms", [])
-                        symptoms_text = "、".join(symptoms_list) if symptoms_list else "無法確定相關症狀"
-                        suggestions_list = response_data.get("suggestions", [])
-                        suggestions_text = "、".join(suggestions_list) if suggestions_list else "建議盡快就醫"
-                        
-                        # Get additional info
-                        additional_info = response_data.get("additional_info", {})
-                        incubation_period = additional_info.get("incubation_period", "未知")
-                        transmission = additional_info.get("transmission", "未知")
-                        prevention_list = additional_info.get("prevention", [])
-                        prevention_text = "、".join(prevention_list) if prevention_list else "未知"
-                        
-                        flex_message = {
-                            "type": "bubble",
-                            "header": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "🔍 症狀分析結果",
-                                        "weight": "bold",
-                                        "color": "#FFFFFF",
-                                        "size": "xl"
-                                    }
-                                ],
-                                "backgroundColor": "#27AE60",
-                                "paddingAll": "20px"
-                            },
-                            "body": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "box",
-                                        "layout": "vertical",
-                                        "contents": [
-                                            {
-                                                "type": "text",
-                                                "text": "可能的疾病",
-                                                "weight": "bold",
-                                                "size": "md",
-                                                "color": "#666666"
-                                            },
-                                            {
-                                                "type": "text",
-                                                "text": disease_text,
-                                                "size": "md",
-                                                "wrap": True,
-                                                "margin": "sm",
-                                                "color": "#333333"
-                                            }
-                                        ],
-                                        "margin": "md"
-                                    },
-                                    {
-                                        "type": "separator",
-                                        "margin": "xxl"
-                                    },
-                                    {
-                                        "type": "box",
-                                        "layout": "vertical",
-                                        "contents": [
-                                            {
-                                                "type": "text",
-                                                "text": "相關症狀",
-                                                "weight": "bold",
-                                                "size": "md",
-                                                "color": "#666666"
-                                            },
-                                            {
-                                                "type": "text",
-                                                "text": symptoms_text,
-                                                "size": "md",
-                                                "wrap": True,
-                                                "margin": "sm",
-                                                "color": "#333333"
-                                            }
-                                        ],
-                                        "margin": "md"
-                                    },
-                                    {
-                                        "type": "separator",
-                                        "margin": "xxl"
-                                    },
-                                    {
-                                        "type": "box",
-                                        "layout": "vertical",
-                                        "contents": [
-                                            {
-                                                "type": "text",
-                                                "text": "建議事項",
-                                                "weight": "bold",
-                                                "size": "md",
-                                                "color": "#666666"
-                                            },
-                                            {
-                                                "type": "text",
-                                                "text": suggestions_text,
-                                                "size": "md",
-                                                "wrap": True,
-                                                "margin": "sm",
-                                                "color": "#333333"
-                                            }
-                                        ],
-                                        "margin": "md"
-                                    },
-                                    {
-                                        "type": "separator",
-                                        "margin": "xxl"
-                                    },
-                                    {
-                                        "type": "box",
-                                        "layout": "vertical",
-                                        "contents": [
-                                            {
-                                                "type": "text",
-                                                "text": "疾病資訊",
-                                                "weight": "bold",
-                                                "size": "md",
-                                                "color": "#666666"
-                                            },
-                                            {
-                                                "type": "box",
-                                                "layout": "vertical",
-                                                "contents": [
-                                                    {
-                                                        "type": "box",
-                                                        "layout": "horizontal",
-                                                        "contents": [
-                                                            {
-                                                                "type": "text",
-                                                                "text": "潛伏期",
-                                                                "size": "sm",
-                                                                "color": "#666666",
-                                                                "flex": 2
-                                                            },
-                                                            {
-                                                                "type": "text",
-                                                                "text": incubation_period,
-                                                                "size": "sm",
-                                                                "color": "#333333",
-                                                                "flex": 3,
-                                                                "wrap": True
-                                                            }
-                                                        ],
-                                                        "margin": "sm"
-                                                    },
-                                                    {
-                                                        "type": "box",
-                                                        "layout": "horizontal",
-                                                        "contents": [
-                                                            {
-                                                                "type": "text",
-                                                                "text": "傳播方式",
-                                                                "size": "sm",
-                                                                "color": "#666666",
-                                                                "flex": 2
-                                                            },
-                                                            {
-                                                                "type": "text",
-                                                                "text": transmission,
-                                                                "size": "sm",
-                                                                "color": "#333333",
-                                                                "flex": 3,
-                                                                "wrap": True
-                                                            }
-                                                        ],
-                                                        "margin": "sm"
-                                                    },
-                                                    {
-                                                        "type": "box",
-                                                        "layout": "horizontal",
-                                                        "contents": [
-                                                            {
-                                                                "type": "text",
-                                                                "text": "預防措施",
-                                                                "size": "sm",
-                                                                "color": "#666666",
-                                                                "flex": 2
-                                                            },
-                                                            {
-                                                                "type": "text",
-                                                                "text": prevention_text,
-                                                                "size": "sm",
-                                                                "color": "#333333",
-                                                                "flex": 3,
-                                                                "wrap": True
-                                                            }
-                                                        ],
-                                                        "margin": "sm"
-                                                    }
-                                                ],
-                                                "margin": "sm"
-                                            }
-                                        ],
-                                        "margin": "md"
-                                    }
-                                ],
-                                "paddingAll": "20px"
-                            },
-                            "footer": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "⚠️ 請注意：這只是初步分析",
-                                        "color": "#FFFFFF",
-                                        "align": "center",
-                                        "size": "sm"
-                                    }
-                                ],
-                                "backgroundColor": "#E74C3C",
-                                "paddingAll": "15px"
-                            }
-                        }
-                    elif response_data["type"] == "unmatched":
-                        print("[handle text message] type: unmatched")
-                        message_text = str(response_data.get("message", "需要更多資訊來協助您")).strip()
-                        
-                        if not message_text:
-                            message_text = "需要更多資訊來協助您"
-                        
-                        flex_message = {
-                            "type": "bubble",
-                            "header": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "❓ 需要更多資訊",
-                                        "weight": "bold",
-                                        "color": "#FFFFFF",
-                                        "size": "xl"
-                                    }
-                                ],
-                                "backgroundColor": "#F39C12",
-                                "paddingAll": "20px"
-                            },
-                            "body": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": message_text,
-                                        "size": "md",
-                                        "wrap": True,
-                                        "color": "#333333"
-                                    }
-                                ],
-                                "paddingAll": "20px"
-                            },
-                            "footer": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "請提供更多症狀描述",
-                                        "color": "#FFFFFF",
-                                        "align": "center",
-                                        "size": "sm"
-                                    }
-                                ],
-                                "backgroundColor": "#F39C12",
-                                "paddingAll": "15px"
-                            }
-                        }
-                    else:  # unrelated
-                        print("[handle text message] type: unrelated")
-                        message_text = str(response_data.get("message", "抱歉，我無法理解您的問題")).strip()
-                        
-                        if not message_text:
-                            message_text = "抱歉，我無法理解您的問題"
-                        
-                        flex_message = {
-                            "type": "bubble",
-                            "header": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "💬 一般對話",
-                                        "weight": "bold",
-                                        "color": "#FFFFFF",
-                                        "size": "xl"
-                                    }
-                                ],
-                                "backgroundColor": "#3498DB",
-                                "paddingAll": "20px"
-                            },
-                            "body": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": message_text,
-                                        "size": "md",
-                                        "wrap": True,
-                                        "color": "#333333"
-                                    }
-                                ],
-                                "paddingAll": "20px"
-                            }
-                        }
-
-                    logging.info(f"Created Flex Message: {json.dumps(flex_message, ensure_ascii=False)}")
-
-                    # Send Flex Message
-                    with ApiClient(self.config) as api_client:
-                        line_bot_api = MessagingApi(api_client)
-                        response = line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                replyToken=event.reply_token,
-                                messages=[
-                                    FlexMessage(
-                                        alt_text="醫療諮詢回覆",
-                                        contents=FlexContainer.from_json(json.dumps(flex_message))
-                                    )
-                                ],
-                                notificationDisabled=False,
-                            )
-                        )
-                        logging.info(f"Line API response: {response}")
-
-                except json.JSONDecodeError as e:
-                    logging.error(f"Failed to parse GPT response as JSON: {e}")
-                    # If response is not valid JSON, send as text message
-                    with ApiClient(self.config) as api_client:
-                        line_bot_api = MessagingApi(api_client)
-                        response = line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                replyToken=event.reply_token,
-                                messages=[TextMessage(text=gpt_response)],
-                                notificationDisabled=False,
-                            )
-                        )
+                # 查詢 FAISS 並產生回覆（含對話記憶）
+                user_id = getattr(event.source, "user_id", None)
+                gpt_response = self.__answer_question(user_id, question)
+                if payload_sampled(logger):
+                    logger.debug("GPT response: %s", redact(gpt_response))
+                self.__reply_answer(event.reply_token, gpt_response)
 
             except Exception as e:
                 error_message = f"Error processing message: {str(e)}"
-                logging.error(error_message)
+                logger.exception("Error processing message: %s", e)
+                metrics.mark_event_failed(e)
 
                 # Try to send error message to user
                 try:
-                    with ApiClient(self.config) as api_client:
-                        line_bot_api = MessagingApi(api_client)
-                        line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                replyToken=event.reply_token,
-                                messages=[
-                                    TextMessage(
-                                        text="抱歉，處理您的訊息時發生錯誤。請稍後再試。"
-                                    )
-                                ],
-                                notificationDisabled=False,
-                            )
-                        )
-                        logging.info("Successfully sent error message to user")
+                    self.__reply_text(
+                        event.reply_token, "抱歉，處理您的訊息時發生錯誤。請稍後再試。"
+                    )
                 except Exception as reply_error:
-                    logging.error(f"Failed to send error message: {str(reply_error)}")
+                    logger.error("Failed to send error message: %s", reply_error)
 
                 return error_message
 
         @self.handler.add(MessageEvent, message=AudioMessageContent)
+        @metrics.tracked("audio")
         def handle_audio_message(event: MessageEvent):
-            logging.info(event.message.id)
             if event.reply_token is None:
                 return
 
-            try:
-                # 接收使用者語音訊息並存檔
-                with ApiClient(self.config) as api_client:
-                    line_bot_blob_api = MessagingApiBlob(api_client)
-                    audio_content = line_bot_blob_api.get_message_content(event.message.id)
+            # 下載前先依 LINE 提供的長度決定是否處理
+            admission = self.audio_admission.admit(event.message.duration)
+            logger.info(
+                "Audio message %s: duration=%sms admission=%s fast=%s",
+                event.message.id,
+                event.message.duration,
+                admission.action,
+                admission.fast,
+            )
+            if admission.action == EMPTY:
+                self.__reply_text(event.reply_token, AUDIO_EMPTY_REPLY)
+                return
+            if admission.action == REJECT:
+                self.__reply_text(event.reply_token, self.audio_too_long_reply)
+                return
 
-                    # TODO: We might need to setup an auto-delete or sth
-                    with tempfile.NamedTemporaryFile(
-                        dir="./audio", prefix="m4a-", delete=False
-                    ) as tf:
-                        tf.write(audio_content)
-                        src = tf.name
+            try:
+                # 下載語音訊息並在記憶體中轉成 PCM，不寫入磁碟
+                audio_content = self.line_api.get_message_content(
+                    event.message.id, max_bytes=self.audio_admission.max_bytes
+                )
+                decoded = self.audio_decoder.decode(audio_content, admission.max_seconds)
+                audio = decoded.audio
+                seconds = audio_seconds(audio)
+                metrics.observe_stage("decode_queue", decoded.queue_wait)
+                metrics.observe_stage(
+                    "decode",
+                    decoded.decode_time,
+                    source_bytes=decoded.source_bytes,
+                    source_seconds=round(decoded.source_seconds, 2),
+                    audio_seconds=round(seconds, 2),
+                )
+                logger.info(
+                    "Decoded audio %s: queue_wait=%.0fms decode=%.0fms "
+                    "saved=%d bytes, %.1fs of %.1fs",
+                    event.message.id,
+                    decoded.queue_wait * 1000,
+                    decoded.decode_time * 1000,
+                    decoded.source_bytes - len(audio.frame_data),
+                    decoded.source_seconds - seconds,
+                    decoded.source_seconds,
+                )
 
-                # 轉檔
-                dst = f"{src}.wav"
-                sound = AudioSegment.from_file(src)
-                sound.export(dst, format="wav")
+                if not audio.frame_data:
+                    # 去除靜音後沒有剩下任何聲音
+                    self.__reply_text(event.reply_token, AUDIO_EMPTY_REPLY)
+                    return
 
-                # 辨識
-                r = sr.Recognizer()
-                with sr.AudioFile(dst) as source:
-                    audio = r.record(source)
+                # 辨識（轉傳或重送的相同語音直接使用快取）
+                asr = self.fast_asr if admission.fast else self.asr
+                cache_key = self.transcriptions.key(
+                    audio, asr.backend.name, self.asr_language
+                )
                 try:
-                    text = r.recognize_google(audio, language="zh-Hant")
-                    logging.info(f"Transcribed text: {text}")
+                    text = self.transcriptions.get(cache_key)
+                    if text is None:
+                        with metrics.stage("asr", upstream=f"asr_{asr.backend.name}") as span:
+                            span.set("audio_seconds", round(seconds, 2))
+                            text = asr.transcribe(audio, self.asr_language)
+                        self.transcriptions.put(cache_key, text)
+                    else:
+                        logger.info("Transcription cache hit")
+                    if payload_sampled(logger):
+                        logger.debug("Transcribed text: %s", redact(text))
                 except Exception as e:
-                    logging.error(f"Error transcribing audio: {e}")
+                    logger.error("Error transcribing audio: %s", e)
                     raise
 
-                # 查詢 FAISS
-                context_chunks = self.ai.query_faiss(text)
-                paragraph = "\n\n".join(context_chunks)
+                # 查詢 FAISS 並產生回覆（含對話記憶）
+                user_id = getattr(event.source, "user_id", None)
+                gpt_response = self.__answer_question(user_id, text)
+                if payload_sampled(logger):
+                    logger.debug("GPT response: %s", redact(gpt_response))
+                self.__reply_answer(event.reply_token, gpt_response)
 
-                # Generate response using GPT
-                gpt_response = self.ai.generate_gpt_response(paragraph, text)
-                logging.info(f"Generated GPT response: {gpt_response}")
-
-                try:
-                    # Parse GPT response
-                    response_data = json.loads(gpt_response)
-                    
-                    # Create Flex Message based on response type
-                    if response_data["type"] == "matched":
-                        print("[handle audio message] type: matched")
-                        # Ensure text fields are not None or empty
-                        disease_text = str(response_data.get("disease", "無法確定可能的疾病")).strip()
-                        symptoms_list = response_data.get("symptoms", [])
-                        symptoms_text = "、".join(str(s) for s in symptoms_list) if symptoms_list else "無法確定相關症狀"
-                        suggestions_list = response_data.get("suggestions", [])
-                        suggestions_text = "、".join(str(s) for s in suggestions_list) if suggestions_list else "建議盡快就醫"
-                        
-                        # Get additional info
-                        additional_info = response_data.get("additional_info", {})
-                        incubation_period = str(additional_info.get("incubation_period", "未知")).strip()
-                        transmission = str(additional_info.get("transmission", "未知")).strip()
-                        prevention_list = additional_info.get("prevention", [])
-                        prevention_text = "、".join(str(p) for p in prevention_list) if prevention_list else "未知"
-                        
-                        flex_message = {
-                            "type": "bubble",
-                            "header": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "🔍 症狀分析結果",
-                                        "weight": "bold",
-                                        "color": "#FFFFFF",
-                                        "size": "xl"
-                                    }
-                                ],
-                                "backgroundColor": "#27AE60",
-                                "paddingAll": "20px"
-                            },
-                            "body": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "box",
-                                        "layout": "vertical",
-                                        "contents": [
-                                            {
-                                                "type": "text",
-                                                "text": "可能的疾病",
-                                                "weight": "bold",
-                                                "size": "md",
-                                                "color": "#666666"
-                                            },
-                                            {
-                                                "type": "text",
-                                                "text": disease_text,
-                                                "size": "md",
-                                                "wrap": True,
-                                                "margin": "sm",
-                                                "color": "#333333"
-                                            }
-                                        ],
-                                        "margin": "md"
-                                    },
-                                    {
-                                        "type": "separator",
-                                        "margin": "xxl"
-                                    },
-                                    {
-                                        "type": "box",
-                                        "layout": "vertical",
-                                        "contents": [
-                                            {
-                                                "type": "text",
-                                                "text": "相關症狀",
-                                                "weight": "bold",
-                                                "size": "md",
-                                                "color": "#666666"
-                                            },
-                                            {
-                                                "type": "text",
-                                                "text": symptoms_text,
-                                                "size": "md",
-                                                "wrap": True,
-                                                "margin": "sm",
-                                                "color": "#333333"
-                                            }
-                                        ],
-                                        "margin": "md"
-                                    },
-                                    {
-                                        "type": "separator",
-                                        "margin": "xxl"
-                                    },
-                                    {
-                                        "type": "box",
-                                        "layout": "vertical",
-                                        "contents": [
-                                            {
-                                                "type": "text",
-                                                "text": "建議事項",
-                                                "weight": "bold",
-                                                "size": "md",
-                                                "color": "#666666"
-                                            },
-                                            {
-                                                "type": "text",
-                                                "text": suggestions_text,
-                                                "size": "md",
-                                                "wrap": True,
-                                                "margin": "sm",
-                                                "color": "#333333"
-                                            }
-                                        ],
-                                        "margin": "md"
-                                    },
-                                    {
-                                        "type": "separator",
-                                        "margin": "xxl"
-                                    },
-                                    {
-                                        "type": "box",
-                                        "layout": "vertical",
-                                        "contents": [
-                                            {
-                                                "type": "text",
-                                                "text": "疾病資訊",
-                                                "weight": "bold",
-                                                "size": "md",
-                                                "color": "#666666"
-                                            },
-                                            {
-                                                "type": "box",
-                                                "layout": "vertical",
-                                                "contents": [
-                                                    {
-                                                        "type": "box",
-                                                        "layout": "horizontal",
-                                                        "contents": [
-                                                            {
-                                                                "type": "text",
-                                                                "text": "潛伏期",
-                                                                "size": "sm",
-                                                                "color": "#666666",
-                                                                "flex": 2
-                                                            },
-                                                            {
-                                                                "type": "text",
-                                                                "text": incubation_period,
-                                                                "size": "sm",
-                                                                "color": "#333333",
-                                                                "flex": 3,
-                                                                "wrap": True
-                                                            }
-                                                        ],
-                                                        "margin": "sm"
-                                                    },
-                                                    {
-                                                        "type": "box",
-                                                        "layout": "horizontal",
-                                                        "contents": [
-                                                            {
-                                                                "type": "text",
-                                                                "text": "傳播方式",
-                                                                "size": "sm",
-                                                                "color": "#666666",
-                                                                "flex": 2
-                                                            },
-                                                            {
-                                                                "type": "text",
-                                                                "text": transmission,
-                                                                "size": "sm",
-                                                                "color": "#333333",
-                                                                "flex": 3,
-                                                                "wrap": True
-                                                            }
-                                                        ],
-                                                        "margin": "sm"
-                                                    },
-                                                    {
-                                                        "type": "box",
-                                                        "layout": "horizontal",
-                                                        "contents": [
-                                                            {
-                                                                "type": "text",
-                                                                "text": "預防措施",
-                                                                "size": "sm",
-                                                                "color": "#666666",
-                                                                "flex": 2
-                                                            },
-                                                            {
-                                                                "type": "text",
-                                                                "text": prevention_text,
-                                                                "size": "sm",
-                                                                "color": "#333333",
-                                                                "flex": 3,
-                                                                "wrap": True
-                                                            }
-                                                        ],
-                                                        "margin": "sm"
-                                                    }
-                                                ],
-                                                "margin": "sm"
-                                            }
-                                        ],
-                                        "margin": "md"
-                                    }
-                                ],
-                                "paddingAll": "20px"
-                            },
-                            "footer": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "⚠️ 請注意：這只是初步分析",
-                                        "color": "#FFFFFF",
-                                        "align": "center",
-                                        "size": "sm"
-                                    }
-                                ],
-                                "backgroundColor": "#E74C3C",
-                                "paddingAll": "15px"
-                            }
-                        }
-                    elif response_data["type"] == "unmatched":
-                        print("[handle audio message] type: unmatched")
-                        message_text = str(response_data.get("message", "需要更多資訊來協助您")).strip()
-                        
-                        if not message_text:
-                            message_text = "需要更多資訊來協助您"
-                        
-                        flex_message = {
-                            "type": "bubble",
-                            "header": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "❓ 需要更多資訊",
-                                        "weight": "bold",
-                                        "color": "#FFFFFF",
-                                        "size": "xl"
-                                    }
-                                ],
-                                "backgroundColor": "#F39C12",
-                                "paddingAll": "20px"
-                            },
-                            "body": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": message_text,
-                                        "size": "md",
-                                        "wrap": True,
-                                        "color": "#333333"
-                                    }
-                                ],
-                                "paddingAll": "20px"
-                            },
-                            "footer": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "請提供更多症狀描述",
-                                        "color": "#FFFFFF",
-                                        "align": "center",
-                                        "size": "sm"
-                                    }
-                                ],
-                                "backgroundColor": "#F39C12",
-                                "paddingAll": "15px"
-                            }
-                        }
-                    else:  # unrelated
-                        print("[handle audio message] type: unrelated")
-                        message_text = str(response_data.get("message", "抱歉，我無法理解您的問題")).strip()
-                        
-                        if not message_text:
-                            message_text = "抱歉，我無法理解您的問題"
-                        
-                        flex_message = {
-                            "type": "bubble",
-                            "header": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": "💬 一般對話",
-                                        "weight": "bold",
-                                        "color": "#FFFFFF",
-                                        "size": "xl"
-                                    }
-                                ],
-                                "backgroundColor": "#3498DB",
-                                "paddingAll": "20px"
-                            },
-                            "body": {
-                                "type": "box",
-                                "layout": "vertical",
-                                "contents": [
-                                    {
-                                        "type": "text",
-                                        "text": message_text,
-                                        "size": "md",
-                                        "wrap": True,
-                                        "color": "#333333"
-                                    }
-                                ],
-                                "paddingAll": "20px"
-                            }
-                        }
-
-                    logging.info(f"Created Flex Message: {json.dumps(flex_message, ensure_ascii=False)}")
-
-                    # Send Flex Message
-                    with ApiClient(self.config) as api_client:
-                        line_bot_api = MessagingApi(api_client)
-                        response = line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                replyToken=event.reply_token,
-                                messages=[
-                                    FlexMessage(
-                                        alt_text="醫療諮詢回覆",
-                                        contents=FlexContainer.from_json(json.dumps(flex_message))
-                                    )
-                                ],
-                                notificationDisabled=False,
-                            )
-                        )
-                        logging.info(f"Line API response: {response}")
-
-                except json.JSONDecodeError as e:
-                    logging.error(f"Failed to parse GPT response as JSON: {e}")
-                    # If response is not valid JSON, send as text message
-                    with ApiClient(self.config) as api_client:
-                        line_bot_api = MessagingApi(api_client)
-                        response = line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                replyToken=event.reply_token,
-                                messages=[TextMessage(text=gpt_response)],
-                                notificationDisabled=False,
-                            )
-                        )
+            except AudioTooLarge as e:
+                logger.warning("Rejected audio %s: %s", event.message.id, e)
+                self.__reply_text(event.reply_token, self.audio_too_long_reply)
 
             except Exception as e:
                 error_message = f"Error processing audio message: {str(e)}"
-                logging.error(error_message)
+                logger.exception("Error processing audio message: %s", e)
+                metrics.mark_event_failed(e)
 
                 # Try to send error message to user
                 try:
-                    with ApiClient(self.config) as api_client:
-                        line_bot_api = MessagingApi(api_client)
-                        line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                replyToken=event.reply_token,
-                                messages=[
-                                    TextMessage(
-                                        text="抱歉，處理您的語音訊息時發生錯誤。請稍後再試。"
-                                    )
-                                ],
-                                notificationDisabled=False,
-                            )
-                        )
-                        logging.info("Successfully sent error message to user")
+                    self.__reply_text(
+                        event.reply_token, "抱歉，處理您的語音訊息時發生錯誤。請稍後再試。"
+                    )
                 except Exception as reply_error:
-                    logging.error(f"Failed to send error message: {str(reply_error)}")
+                    logger.error("Failed to send error message: %s", reply_error)
 
                 return error_message
 
         @self.handler.add(MessageEvent, message=LocationMessageContent)
+        @metrics.tracked("location")
         def handle_location_message(event: MessageEvent):
-            def search_nearby_clinics(lat, lng, radius=2000, keyword="診所"):
-                url = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-                params = {
-                    "location": f"{lat},{lng}",
-                    "radius": radius,
-                    "keyword": keyword,
-                    "type": "doctor",
-                    "language": "zh-TW",
-                    "key": os.getenv("GOOGLE_MAPS_API_KEY"),
-                }
-
-                response = requests.get(url, params=params)
-                data = response.json()
-
-                if data.get("status") != "OK":
-                    logging.warning(f"Google Places API error: {data.get('status')}")
-                    return []
-
-                results = []
-                for place in data.get("results", [])[:5]:  # 只取前 5 筆
-                    results.append(
-                        {
-                            "name": place.get("name"),
-                            "address": place.get("vicinity"),
-                            "lat": place["geometry"]["location"]["lat"],
-                            "lng": place["geometry"]["location"]["lng"],
-                        }
-                    )
-
-                return results
-
             def create_clinic_bubbles(clinics):
                 bubbles = []
                 for clinic in clinics:
@@ -1046,60 +570,26 @@ class Bot:
                 return bubbles
 
             latitude, longitude = event.message.latitude, event.message.longitude
-            logging.info(f"Received: {latitude}, {longitude}")
+            logger.info("Location message %s", event.message.id)
 
             try:
-                clinics = search_nearby_clinics(latitude, longitude)
+                clinics = self.__find_clinics(latitude, longitude)
 
                 if not clinics:
                     reply = "找不到附近的診所，建議您聯繫 1922 或前往大型醫院急診。"
-                    with ApiClient(self.config) as api_client:
-                        line_bot_api = MessagingApi(api_client)
-                        line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                replyToken=event.reply_token,
-                                messages=[TextMessage(text=reply)],
-                                notificationDisabled=False,
-                            )
-                        )
+                    self.__reply_text(event.reply_token, reply)
                 else:
-                    # Load template
-                    with open("template/clinic_reply.json", "r") as f:
-                        template = json.load(f)
-                    
-                    # Create clinic bubbles
-                    clinic_bubbles = create_clinic_bubbles(clinics)
-                    template["contents"] = clinic_bubbles
-
-                    # Send Flex Message
-                    with ApiClient(self.config) as api_client:
-                        line_bot_api = MessagingApi(api_client)
-                        line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                replyToken=event.reply_token,
-                                messages=[
-                                    FlexMessage(
-                                        alt_text="附近診所資訊",
-                                        contents=FlexContainer.from_json(json.dumps(template))
-                                    )
-                                ],
-                                notificationDisabled=False,
-                            )
-                        )
+                    contents = self.flex_templates.render(
+                        "clinic_reply", clinic_bubbles=create_clinic_bubbles(clinics)
+                    )
+                    self.line_api.reply(
+                        event.reply_token, [flex_message("附近診所資訊", contents)]
+                    )
 
             except Exception as e:
-                logging.error(f"Error during clinic search: {e}")
-                with ApiClient(self.config) as api_client:
-                    line_bot_api = MessagingApi(api_client)
-                    line_bot_api.reply_message(
-                        ReplyMessageRequest(
-                            replyToken=event.reply_token,
-                            messages=[
-                                TextMessage(text="目前無法查詢附近診所，請稍後再試。")
-                            ],
-                            notificationDisabled=False,
-                        )
-                    )
+                logger.exception("Error during clinic search: %s", e)
+                metrics.mark_event_failed(e)
+                self.__reply_text(event.reply_token, "目前無法查詢附近診所，請稍後再試。")
 
         @self.app.route("/test-gpt", methods=["POST"])
         def test_gpt():
@@ -1117,9 +607,8 @@ class Bot:
 
                 return {"status": "success", "response": response}
             except Exception as e:
-                logging.error(f"Error in GPT test: {e}")
+                logger.error("Error in GPT test: %s", e)
                 return {"error": str(e)}, 500
 
     def run(self):
-        self.app.logger.setLevel("INFO")
         self.app.run(host="0.0.0.0", port=8080)
@@ -0,0 +1,187 @@
+"""Post signed LINE webhook events to the bot and report latency percentiles.
+
+The bot handles each webhook synchronously, so the HTTP response time is
+the end-to-end time from receiving the event to sending the LINE reply.
+
+    python -m loadtest.load_generator --target http://127.0.0.1:8080/webhook \\
+        --secret "$LINE_CHANNEL_SECRET" --concurrency 8 --requests 500 \\
+        --mix text=0.7,audio=0.2,location=0.1
+"""
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+TEXT_MESSAGES = [
+    "我最近常常口渴，喝很多水，也常常上廁所，體重也下降了。",
+    "我最近頭痛，而且會發燒到39度。",
+    "喉嚨痛又一直咳嗽",
+    "今天天氣如何？",
+    "謝謝",
+    "你好",
+]
+
+# 台北、台中、高雄附近的位置
+LOCATIONS = [(25.0330, 121.5654), (24.1477, 120.6736), (22.6273, 120.3014)]
+
+
+def build_event(kind: str) -> dict:
+    if kind == "text":
+        message = {
+            "type": "text",
+            "id": str(random.getrandbits(60)),
+            "quoteToken": uuid.uuid4().hex,
+            "text": random.choice(TEXT_MESSAGES),
+        }
+    elif kind == "audio":
+        message = {
+            "type": "audio",
+            "id": str(random.getrandbits(60)),
+            "duration": random.randint(5000, 30000),
+            "contentProvider": {"type": "line"},
+        }
+    elif kind == "location":
+        lat, lng = random.choice(LOCATIONS)
+        message = {
+            "type": "location",
+            "id": str(random.getrandbits(60)),
+            "title": "目前位置",
+            "address": "測試地址",
+            "latitude": lat + random.uniform(-0.02, 0.02),
+            "longitude": lng + random.uniform(-0.02, 0.02),
+        }
+    else:
+        raise ValueError(f"Unknown event type: {kind}")
+
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": f"U{random.randrange(1000):032x}"},
+        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": uuid.uuid4().hex,
+        "message": message,
+    }
+
+
+def sign(body: bytes, secret: str) -> str:
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        kind, weight = part.split("=")
+        weights[kind.strip()] = float(weight)
+    return weights
+
+
+def run(
+    target: str,
+    secret: str,
+    mix: dict[str, float],
+    concurrency: int,
+    total: int,
+    duration: float | None,
+):
+    kinds, weights = list(mix), list(mix.values())
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration if duration else None
+    sent = 0
+
+    def worker():
+        nonlocal sent
+        session = requests.Session()
+        while True:
+            with lock:
+                if (deadline and time.monotonic() > deadline) or (not deadline and sent >= total):
+                    return
+                sent += 1
+            kind = random.choices(kinds, weights)[0]
+            body = json.dumps(
+                {"destination": "U" + "0" * 32, "events": [build_event(kind)]},
+                ensure_ascii=False,
+            ).encode()
+
+            start = time.perf_counter()
+            try:
+                response = session.post(
+                    target,
+                    data=body,
+                    headers={
+                        "Content-Type": "application/json",
+                        "X-Line-Signature": sign(body, secret),
+                    },
+                    timeout=120,
+                )
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+
+            with lock:
+                latencies[kind].append(elapsed)
+                if not ok:
+                    errors[kind] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - start
+
+    report(latencies, errors, wall)
+
+
+def report(latencies: dict[str, list[float]], errors: dict[str, int], wall: float):
+    every = [v for values in latencies.values() for v in values]
+    print(f"{len(every)} requests in {wall:.1f}s, {len(every) / wall:.2f} req/s")
+    print(f"{'type':<10} {'count':>6} {'errors':>6} {'p50':>8} {'p95':>8} {'p99':>8}")
+    rows = sorted(latencies.items()) + [("all", every)]
+    for kind, values in rows:
+        error_count = sum(errors.values()) if kind == "all" else errors[kind]
+        print(
+            f"{kind:<10} {len(values):>6} {error_count:>6} "
+            + " ".join(f"{percentile(values, q) * 1000:>6.0f}ms" for q in (50, 95, 99))
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", required=True, help="LINE channel secret the bot uses")
+    parser.add_argument("--mix", default="text=0.7,audio=0.2,location=0.1")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--duration", type=float, help="run for N seconds instead")
+    args = parser.parse_args()
+
+    run(
+        args.target,
+        args.secret,
+        parse_mix(args.mix),
+        args.concurrency,
+        args.requests,
+        args.duration,
+    )
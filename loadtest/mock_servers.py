@@ -0,0 +1,240 @@
+"""Local stand-ins for the LINE, OpenAI, Google Places and Google speech APIs.
+
+Every endpoint sleeps for a latency drawn from a configurable distribution
+and fails with a configurable probability, so the bot can be load-tested
+without network access or API bills.
+
+    python -m loadtest.mock_servers --port 9000 [--profile loadtest/profiles/degraded.json]
+
+Point the bot at it with (see README "Load Testing"):
+
+    LINE_API_HOST=http://127.0.0.1:9000
+    LINE_DATA_API_HOST=http://127.0.0.1:9000
+    OPENAI_BASE_URL=http://127.0.0.1:9000/v1
+    GOOGLE_PLACES_URL=http://127.0.0.1:9000/maps/api/place/nearbysearch/json
+    http_proxy=http://127.0.0.1:9000 NO_PROXY=127.0.0.1,localhost
+
+speech_recognition posts to a hard-coded http://www.google.com URL, so the
+speech endpoint is reached by using this server as the plain-HTTP proxy.
+"""
+
+import argparse
+import base64
+import io
+import json
+import math
+import random
+import struct
+import threading
+import time
+import uuid
+import wave
+from collections import Counter
+
+from flask import Flask, Response, jsonify, request
+
+DEFAULT_PROFILE = {
+    "line_reply": {"latency": {"dist": "lognormal", "median_ms": 80, "p99_ms": 400}},
+    "line_content": {
+        "latency": {"dist": "lognormal", "median_ms": 150, "p99_ms": 800},
+        "audio_seconds": 8,
+    },
+    "openai_embeddings": {
+        "latency": {"dist": "lognormal", "median_ms": 120, "p99_ms": 600},
+        "dim": 1536,
+    },
+    "openai_chat": {"latency": {"dist": "lognormal", "median_ms": 1500, "p99_ms": 6000}},
+    "places": {"latency": {"dist": "lognormal", "median_ms": 400, "p99_ms": 1500}},
+    "speech": {
+        "latency": {"dist": "lognormal", "median_ms": 700, "p99_ms": 3000},
+        "transcript": "我最近頭痛而且發燒",
+    },
+}
+
+# 依問題內容回覆不同類型，讓三種 flex message 都會被測到
+_CHAT_REPLIES = [
+    (("頭痛", "發燒", "咳"), {"t": "u", "m": "需要更多資訊", "q": ["發燒幾天"], "g": ["多休息"], "n": 1, "r": "m", "c": ["流感"]}),
+    (("口渴", "上廁所", "體重"), {"t": "m", "d": "糖尿病", "s": ["多飲", "多尿"], "g": ["就醫檢查血糖"], "n": 1, "r": "m", "i": "無", "v": "不具傳染性", "p": ["規律運動"]}),
+]
+_UNRELATED_REPLY = {"t": "x", "m": "我主要協助回答健康相關的問題", "g": ["歡迎描述您的症狀"]}
+
+
+def sample_latency(spec: dict) -> float:
+    """Return a latency in seconds drawn from `spec`.
+
+    Supported distributions: fixed (ms), uniform (min_ms, max_ms) and
+    lognormal (median_ms, p99_ms).
+    """
+    dist = spec.get("dist", "fixed")
+    if dist == "fixed":
+        return spec.get("ms", 0) / 1000
+    if dist == "uniform":
+        return random.uniform(spec["min_ms"], spec["max_ms"]) / 1000
+    if dist == "lognormal":
+        mu = math.log(spec["median_ms"])
+        sigma = max(math.log(spec["p99_ms"] / spec["median_ms"]) / 2.326, 1e-6)
+        return random.lognormvariate(mu, sigma) / 1000
+    raise ValueError(f"Unknown latency distribution: {dist}")
+
+
+def synth_wav(seconds: float, sample_rate: int = 16000) -> bytes:
+    """A 440 Hz tone with half a second of silence on each side"""
+    buffer = io.BytesIO()
+    silence = int(sample_rate * 0.5)
+    tone = int(sample_rate * max(seconds - 1, 0))
+    frames = bytearray(struct.pack("<h", 0) * silence)
+    for i in range(tone):
+        frames += struct.pack("<h", int(8000 * math.sin(2 * math.pi * 440 * i / sample_rate)))
+    frames += struct.pack("<h", 0) * silence
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+def create_app(profile: dict) -> Flask:
+    app = Flask(__name__)
+    stats = Counter()
+    lock = threading.Lock()
+    audio = synth_wav(profile["line_content"].get("audio_seconds", 8))
+
+    def simulate(service: str) -> bool:
+        """Sleep for the service latency; return False if this call should fail"""
+        spec = profile[service]
+        time.sleep(sample_latency(spec.get("latency", {})))
+        failed = random.random() < spec.get("error_rate", 0.0)
+        with lock:
+            stats[service] += 1
+            if failed:
+                stats[f"{service}_errors"] += 1
+        return not failed
+
+    @app.route("/v2/bot/message/reply", methods=["POST"])
+    def line_reply():
+        if not simulate("line_reply"):
+            return jsonify({"message": "Internal server error"}), 500
+        return jsonify({"sentMessages": [{"id": uuid.uuid4().hex, "quoteToken": uuid.uuid4().hex}]})
+
+    @app.route("/v2/bot/message/<message_id>/content", methods=["GET"])
+    def line_content(message_id):
+        if not simulate("line_content"):
+            return jsonify({"message": "Internal server error"}), 500
+        return Response(audio, mimetype="audio/wav")
+
+    @app.route("/v1/embeddings", methods=["POST"])
+    def openai_embeddings():
+        if not simulate("openai_embeddings"):
+            return jsonify({"error": {"message": "Server error", "type": "server_error"}}), 500
+        body = request.get_json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dim = profile["openai_embeddings"].get("dim", 1536)
+
+        data = []
+        for i, _ in enumerate(inputs):
+            vector = [random.gauss(0, 1) for _ in range(dim)]
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(struct.pack(f"<{dim}f", *vector)).decode()
+            else:
+                embedding = vector
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        return jsonify(
+            {
+                "object": "list",
+                "data": data,
+                "model": body.get("model"),
+                "usage": {"prompt_tokens": 20, "total_tokens": 20},
+            }
+        )
+
+    @app.route("/v1/chat/completions", methods=["POST"])
+    def openai_chat():
+        if not simulate("openai_chat"):
+            return jsonify({"error": {"message": "Server error", "type": "server_error"}}), 500
+        body = request.get_json()
+        question = body["messages"][-1]["content"].rsplit("使用者症狀描述：", 1)[-1]
+        reply = next(
+            (r for keywords, r in _CHAT_REPLIES if any(k in question for k in keywords)),
+            _UNRELATED_REPLY,
+        )
+        content = json.dumps(reply, ensure_ascii=False)
+        return jsonify(
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": len(question),
+                    "completion_tokens": len(content),
+                    "total_tokens": len(question) + len(content),
+                    "prompt_tokens_details": {"cached_tokens": 0},
+                },
+            }
+        )
+
+    @app.route("/maps/api/place/nearbysearch/json", methods=["GET"])
+    def places():
+        if not simulate("places"):
+            return jsonify({"status": "UNKNOWN_ERROR", "results": []})
+        lat, lng = (float(v) for v in request.args["location"].split(","))
+        results = [
+            {
+                "name": f"測試診所 {i + 1}",
+                "vicinity": f"測試路 {random.randint(1, 300)} 號",
+                "geometry": {
+                    "location": {
+                        "lat": lat + random.uniform(-0.01, 0.01),
+                        "lng": lng + random.uniform(-0.01, 0.01),
+                    }
+                },
+            }
+            for i in range(20)
+        ]
+        return jsonify({"status": "OK", "results": results})
+
+    @app.route("/speech-api/v2/recognize", methods=["POST"])
+    def speech():
+        if not simulate("speech"):
+            return "", 500
+        transcript = profile["speech"].get("transcript", "")
+        result = {
+            "result": [{"alternative": [{"transcript": transcript, "confidence": 0.9}], "final": True}],
+            "result_index": 0,
+        }
+        return '{"result":[]}\n' + json.dumps(result, ensure_ascii=False) + "\n"
+
+    @app.route("/__stats", methods=["GET"])
+    def get_stats():
+        with lock:
+            return jsonify(dict(stats))
+
+    return app
+
+
+def load_profile(path: str | None) -> dict:
+    """DEFAULT_PROFILE with the services in `path` merged on top"""
+    profile = json.loads(json.dumps(DEFAULT_PROFILE))
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            for service, spec in json.load(f).items():
+                profile.setdefault(service, {}).update(spec)
+    return profile
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--profile", help="JSON file overriding DEFAULT_PROFILE")
+    args = parser.parse_args()
+
+    create_app(load_profile(args.profile)).run(host=args.host, port=args.port, threaded=True)
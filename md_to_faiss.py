@@ -1,10 +1,17 @@
-import os
+import argparse
 import glob
-import pickle
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+
 import faiss
+import numpy as np
 import openai
 from tqdm import tqdm
-from sklearn.preprocessing import normalize
+
+from utils.index_store import MetadataWriter, count_metadata, shard_of, update_manifest
 
 # 初始化 OpenAI API
 openai.api_key = os.getenv("OPENAI_API_KEY")
@@ -15,6 +22,11 @@ INDEX_OUTPUT_PATH = "disease_index.faiss"
 METADATA_OUTPUT_PATH = "disease_metadata.pkl"
 CHUNK_SIZE = 300  # 字數（可調整）
 EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_BATCH_SIZE = 100  # 每次呼叫 API 送出的 chunk 數，也是寫入 index 的批次大小
+CHECKPOINT_DIR = "index_checkpoint"
+MANIFEST_PATH = "index_manifest.json"
+SHARD_DIR = "shards"
+CHECKPOINT_EVERY = 20  # 每隔幾個批次存一次檢查點
 
 # 切 chunk 函數
 def chunk_text(text: str, size: int = CHUNK_SIZE) -> list[str]:
@@ -28,53 +40,252 @@ def get_embedding(text: str) -> list[float]:
     )
     return response.data[0].embedding
 
-# 主程序
-def process_markdown_dir():
-    md_files = glob.glob(os.path.join(MARKDOWN_DIR, "*.md"))
-    embeddings = []
-    metadata = []
+def get_embeddings(texts: list[str]) -> list[list[float]]:
+    response = openai.embeddings.create(
+        input=texts,
+        model=EMBEDDING_MODEL
+    )
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+# 在子程序中讀檔並切 chunk；內容太短的檔案回傳空的 chunk
+def read_chunks(file_path: str) -> tuple[str, list[str]]:
+    with open(file_path, "r", encoding="utf-8") as f:
+        content = f.read().strip()
+    if len(content) < 50:
+        return os.path.basename(file_path), []
+    return os.path.basename(file_path), chunk_text(content)
 
-    for file_path in tqdm(md_files, desc="Processing files"):
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read().strip()
+def iter_file_chunks(md_files: list[str], workers: int):
+    """Yield (filename, chunks) in file order, read and chunked by worker processes.
 
-        if len(content) < 50:
-            continue  # 忽略內容太短的檔案
+    Files are handed out a window at a time, so chunks never pile up in
+    memory while the embedding calls lag behind.
+    """
+    window = workers * 4
+    with multiprocessing.Pool(workers) as pool:
+        for start in range(0, len(md_files), window):
+            yield from pool.imap(read_chunks, md_files[start:start + window])
 
-        filename = os.path.basename(file_path)
-        chunks = chunk_text(content)
+def embed_batch(batch: list[dict]) -> tuple[np.ndarray, list[dict]]:
+    """Normalised float32 vectors for a batch of chunks, and the chunks they belong to.
 
-        for i, chunk in enumerate(chunks):
+    If the batch call fails the chunks are embedded one by one, skipping
+    only those that still fail.
+    """
+    try:
+        vectors = get_embeddings([entry["content"] for entry in batch])
+        kept = batch
+    except (openai.RateLimitError, openai.APIConnectionError):
+        # 逐筆重試也會失敗，交給檢查點在下次執行時續建
+        raise
+    except Exception as e:
+        print(f"⚠️ Error embedding batch, retrying chunks one by one: {e}")
+        vectors, kept = [], []
+        for entry in batch:
             try:
-                emb = get_embedding(chunk)
-                embeddings.append(emb)
-                metadata.append({
+                vectors.append(get_embedding(entry["content"]))
+                kept.append(entry)
+            except Exception as e:
+                print(f"⚠️ Error embedding chunk {entry['chunk_id']} in {entry['filename']}: {e}")
+
+    vectors = np.array(vectors, dtype=np.float32)
+    if kept:
+        # Embedding normalization（重要！可提升準確率）
+        faiss.normalize_L2(vectors)
+    return vectors, kept
+
+def add_batch(index, metadata: MetadataWriter, batch: list[dict]):
+    vectors, kept = embed_batch(batch)
+    if not kept:
+        return index
+    if index is None:
+        index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    metadata.write(kept)
+    return index
+
+def build_fingerprint(md_files: list[str]) -> str:
+    """Identifies the input of a build, so a checkpoint is only resumed with the same input"""
+    digest = hashlib.blake2b(f"{CHUNK_SIZE}\0{EMBEDDING_MODEL}".encode(), digest_size=16)
+    for file_path in md_files:
+        digest.update(f"\0{os.path.basename(file_path)}\0{os.path.getsize(file_path)}".encode())
+    return digest.hexdigest()
+
+def load_checkpoint(checkpoint_dir: str, fingerprint: str):
+    """The saved progress and partial index, or None when there is nothing to resume"""
+    try:
+        with open(os.path.join(checkpoint_dir, "progress.json"), "r", encoding="utf-8") as f:
+            progress = json.load(f)
+    except FileNotFoundError:
+        return None
+    if progress["fingerprint"] != fingerprint:
+        print("⚠️ 檢查點與目前的檔案或設定不符，重新建立索引")
+        return None
+    index = faiss.read_index(os.path.join(checkpoint_dir, "index.faiss"))
+    if index.ntotal != progress["rows"]:
+        print("⚠️ 檢查點的 index 筆數不符，重新建立索引")
+        return None
+    return progress, index
+
+def save_checkpoint(
+    checkpoint_dir: str, index, metadata: MetadataWriter, cursor: tuple[int, int], fingerprint: str
+):
+    """Save the index and the position after its last chunk; progress.json is written last"""
+    progress = {
+        "fingerprint": fingerprint,
+        "file": cursor[0],
+        "chunk": cursor[1],
+        "rows": index.ntotal,
+        "metadata_bytes": metadata.flush(),
+    }
+    index_path = os.path.join(checkpoint_dir, "index.faiss")
+    faiss.write_index(index, f"{index_path}.tmp")
+    os.replace(f"{index_path}.tmp", index_path)
+    progress_path = os.path.join(checkpoint_dir, "progress.json")
+    with open(f"{progress_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(progress, f)
+    os.replace(f"{progress_path}.tmp", progress_path)
+
+# 主程序：讀檔、切 chunk、embedding、寫入 index 依批次串流進行，記憶體用量不隨語料增加
+def process_markdown_dir(
+    markdown_dir: str = MARKDOWN_DIR,
+    workers: int | None = None,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    restart: bool = False,
+    index_path: str = INDEX_OUTPUT_PATH,
+    metadata_path: str = METADATA_OUTPUT_PATH,
+    checkpoint_dir: str = CHECKPOINT_DIR,
+    select=None,
+) -> bool:
+    """Build one index from the Markdown files for which `select(filename)` is true.
+
+    Returns whether an index was written.
+    """
+    md_files = sorted(glob.glob(os.path.join(markdown_dir, "*.md")))
+    if select is not None:
+        md_files = [path for path in md_files if select(os.path.basename(path))]
+    workers = workers or os.cpu_count() or 1
+    fingerprint = build_fingerprint(md_files)
+    metadata_tmp_path = os.path.join(checkpoint_dir, "metadata.pkl")
+
+    checkpoint = None if restart else load_checkpoint(checkpoint_dir, fingerprint)
+    if checkpoint is not None:
+        progress, index = checkpoint
+        metadata = MetadataWriter(
+            metadata_path, metadata_tmp_path, progress["metadata_bytes"], progress["rows"]
+        )
+        done = (progress["file"], progress["chunk"])
+        print(f"↻ 從檢查點續建：已有 {index.ntotal} 筆 embedding，從第 {done[0] + 1} 個檔案繼續")
+    else:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        os.makedirs(checkpoint_dir)
+        index = None
+        metadata = MetadataWriter(metadata_path, metadata_tmp_path)
+        done = (0, 0)
+
+    # done：已寫入 index 的最後一個 chunk 之後的位置（檔案序號, chunk 序號）
+    batch, batch_end, batches = [], done, 0
+    try:
+        for file_pos, (filename, chunks) in enumerate(
+            tqdm(
+                iter_file_chunks(md_files[done[0]:], workers),
+                total=len(md_files),
+                initial=done[0],
+                desc="Processing files",
+            ),
+            done[0],
+        ):
+            for i, chunk in enumerate(chunks):
+                if (file_pos, i) < done:
+                    continue
+                batch.append({
                     "filename": filename,
                     "chunk_id": i,
                     "content": chunk
                 })
-            except Exception as e:
-                print(f"⚠️ Error embedding chunk {i} in {filename}: {e}")
+                batch_end = (file_pos, i + 1)
+                if len(batch) >= batch_size:
+                    index = add_batch(index, metadata, batch)
+                    batch, done, batches = [], batch_end, batches + 1
+                    if index is not None and batches % CHECKPOINT_EVERY == 0:
+                        save_checkpoint(checkpoint_dir, index, metadata, done, fingerprint)
+        if batch:
+            index = add_batch(index, metadata, batch)
+            done = batch_end
+    except BaseException:
+        # 只在 index 與 metadata 一致時存檔，下次執行從這裡續建
+        if index is not None and index.ntotal == metadata.count:
+            save_checkpoint(checkpoint_dir, index, metadata, done, fingerprint)
+            print(f"💾 已儲存檢查點（{index.ntotal} 筆），重新執行即可續建")
+        raise
 
     # 建立 FAISS index
-    if not embeddings:
+    if index is None:
+        metadata.abort()
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
         print("❌ 沒有有效的內容可以建立索引")
-        return
+        return False
+
+    metadata.flush()
+    written = count_metadata(metadata_tmp_path)
+    if not index.ntotal == metadata.count == written:
+        raise RuntimeError(
+            f"index 有 {index.ntotal} 筆，metadata 有 {written} 筆，請以 --restart 重新建立"
+        )
 
-    dim = len(embeddings[0])
-    index = faiss.IndexFlatL2(dim)
-    index.add(normalize_embeddings(embeddings))
+    # 先寫到暫存檔再換名，執行中的 bot 不會讀到寫一半的檔案
+    faiss.write_index(index, f"{index_path}.tmp")
+    os.replace(f"{index_path}.tmp", index_path)
+    metadata.commit()
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
 
-    faiss.write_index(index, INDEX_OUTPUT_PATH)
-    with open(METADATA_OUTPUT_PATH, "wb") as f:
-        pickle.dump(metadata, f)
+    print(f"完成：共儲存 {index.ntotal} 筆 embedding（已確認與 metadata 筆數一致）")
+    return True
 
-    print(f"完成：共儲存 {len(embeddings)} 筆 embedding")
+# 建立一個 shard 並登錄到 manifest；各 shard 有自己的檔案與檢查點，可以分別重建
+def build_shard(name: str, markdown_dir: str, select=None, **options):
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    index_path = os.path.join(SHARD_DIR, f"{name}.faiss")
+    metadata_path = os.path.join(SHARD_DIR, f"{name}_metadata.pkl")
+    print(f"▶ 建立 shard {name}")
+    if process_markdown_dir(
+        markdown_dir,
+        index_path=index_path,
+        metadata_path=metadata_path,
+        checkpoint_dir=os.path.join(SHARD_DIR, f"{name}.checkpoint"),
+        select=select,
+        **options,
+    ):
+        update_manifest(MANIFEST_PATH, name, index_path, metadata_path)
 
-# Embedding normalization（重要！可提升準確率）
-def normalize_embeddings(vectors: list[list[float]]):
-    import numpy as np
-    return normalize(np.array(vectors), axis=1)
+def in_hash_shard(part: int, count: int):
+    return lambda filename: shard_of(filename, count) == part
 
 if __name__ == "__main__":
-    process_markdown_dir()
+    parser = argparse.ArgumentParser(description="Build the FAISS index from Markdown files")
+    parser.add_argument("--markdown-dir", default=MARKDOWN_DIR)
+    parser.add_argument("--workers", type=int, help="processes reading and chunking files")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--restart", action="store_true", help="ignore any saved checkpoint")
+    parser.add_argument("--shard", help=f"build a named shard listed in {MANIFEST_PATH}")
+    parser.add_argument(
+        "--hash-shards", type=int, metavar="N", help="split --shard into N shards by file name"
+    )
+    parser.add_argument(
+        "--only", type=int, nargs="+", metavar="K", help="with --hash-shards, only rebuild these"
+    )
+    args = parser.parse_args()
+    options = {"workers": args.workers, "batch_size": args.batch_size, "restart": args.restart}
+
+    if args.shard is None:
+        process_markdown_dir(args.markdown_dir, **options)
+    elif args.hash_shards is None:
+        build_shard(args.shard, args.markdown_dir, **options)
+    else:
+        for part in args.only if args.only is not None else range(args.hash_shards):
+            build_shard(
+                f"{args.shard}-{part}",
+                args.markdown_dir,
+                in_hash_shard(part, args.hash_shards),
+                **options,
+            )
@@ -1,5 +1,18 @@
 """Prompts for medical advisor GPT responses"""
 
+from utils.tokens import estimate_tokens
+
+# 固定不變的指示全部放在 system prompt，讓每次請求的前綴完全相同，
+# 以利 OpenAI 的 prompt caching；會變動的對話摘要、疾病資料與問題放在最後。
+_ANALYSIS_GUIDE = """
+使用者訊息會依序提供「先前對話摘要」（可能沒有）、「疾病資料」和「使用者症狀描述」。請根據這些資訊判斷屬於哪種情況：
+- 請仔細分析疾病資料中的臨床症狀、潛伏期、傳播方式和預防方法
+- 如果症狀相符，請提供完整的疾病資訊和預防建議
+- 如果症狀不相符，請列出需要補充的資訊和可能的其他疾病
+- 如果問題與疾病無關，請禮貌地引導使用者詢問健康相關問題
+- 如果有先前對話摘要，請將本次描述視為對先前問題的補充
+"""
+
 MEDICAL_ADVISOR_SYSTEM_PROMPT = """
 你是一個專業的醫療顧問，請根據提供的疾病資料回答問題。你的回答必須是 JSON 格式，且符合以下三種情況之一：
 
@@ -48,23 +61,115 @@ MEDICAL_ADVISOR_SYSTEM_PROMPT = """
 6. 根據疾病資料中的「臨床症狀」、「潛伏期」、「傳播方式」和「預防方法」等章節來提供準確的資訊
 7. 在提供建議時，優先考慮疾病資料中提到的預防和治療方法
 8. 如果疾病資料中提到疫苗資訊，在相關情況下也應包含在建議中
-"""
+""" + _ANALYSIS_GUIDE
+
+MEDICAL_ADVISOR_COMPACT_SYSTEM_PROMPT = """
+你是一個專業的醫療顧問，請根據提供的疾病資料回答問題。你的回答必須是單一 JSON 物件，並使用以下精簡鍵名，符合三種情況之一：
+
+1. 當提供的疾病資料與使用者的症狀相符時：
+{"t":"m","d":"可能的疾病名稱","s":["症狀1","症狀2"],"g":["建議1","建議2"],"n":1,"r":"h","i":"潛伏期資訊","v":"傳播方式","p":["預防方法1","預防方法2"]}
+
+2. 當找不到完全相符的症狀時：
+{"t":"u","m":"主要說明訊息","q":["需要補充的資訊1","需要補充的資訊2"],"g":["建議1","建議2"],"n":0,"r":"m","c":["可能的疾病1","可能的疾病2"]}
+
+3. 當使用者詢問與疾病無關的問題時：
+{"t":"x","m":"禮貌的說明訊息","g":["建議1"]}
 
-def format_medical_question(paragraph: str, question: str) -> str:
+鍵名說明：t 類型（m 相符／u 不相符／x 無關）、d 疾病、s 症狀、g 建議、n 是否需要就醫（1/0）、r 緊急程度（h/m/l）、i 潛伏期、v 傳播方式、p 預防方法、m 說明訊息、q 需要補充的資訊、c 可能的疾病
+
+請確保：
+1. 只輸出 JSON，不要包含任何其他文字
+2. 每個陣列最多 3 項，每項盡量簡短
+3. 根據疾病資料中的「臨床症狀」、「潛伏期」、「傳播方式」和「預防方法」等章節來提供準確的資訊
+4. 在提供建議時，優先考慮疾病資料中提到的預防和治療方法
+5. 如果疾病資料中提到疫苗資訊，在相關情況下也應包含在建議中
+""" + _ANALYSIS_GUIDE
+
+_COMPACT_TYPES = {"m": "matched", "u": "unmatched", "x": "unrelated"}
+_COMPACT_URGENCY = {"h": "high", "m": "medium", "l": "low"}
+_TITLES = {
+    "matched": "症狀相符",
+    "unmatched": "找不到完全相符的症狀",
+    "unrelated": "問題與疾病無關",
+}
+
+COMPACT_FALLBACK_RESPONSE = {
+    "type": "unmatched",
+    "title": _TITLES["unmatched"],
+    "message": "抱歉，我需要更多資訊才能判斷，請再描述一次您的症狀。",
+    "additional_info_needed": [],
+    "suggestions": [],
+    "need_doctor": False,
+    "urgency": "low",
+    "possible_conditions": [],
+}
+
+
+def expand_compact_response(data: dict) -> dict:
+    """Expand a short-key response into the shape of MEDICAL_ADVISOR_SYSTEM_PROMPT"""
+    if "t" not in data and "type" in data:
+        return data  # GPT ignored the short keys; already in the full shape
+
+    response_type = _COMPACT_TYPES.get(data.get("t"), "unrelated")
+    expanded = {"type": response_type, "title": _TITLES[response_type]}
+
+    if response_type == "matched":
+        expanded["disease"] = data.get("d", "")
+        expanded["symptoms"] = data.get("s", [])
+    else:
+        expanded["message"] = data.get("m", "")
+    if response_type == "unmatched":
+        expanded["additional_info_needed"] = data.get("q", [])
+
+    expanded["suggestions"] = data.get("g", [])
+
+    if response_type != "unrelated":
+        expanded["need_doctor"] = bool(data.get("n", 0))
+        expanded["urgency"] = _COMPACT_URGENCY.get(data.get("r"), "low")
+    if response_type == "matched":
+        expanded["additional_info"] = {
+            "incubation_period": data.get("i", "未知"),
+            "transmission": data.get("v", "未知"),
+            "prevention": data.get("p", []),
+        }
+    elif response_type == "unmatched":
+        expanded["possible_conditions"] = data.get("c", [])
+    return expanded
+
+
+def format_medical_question(
+    paragraph: str, question: str, history: list[str] | None = None
+) -> str:
     """Format the medical question for GPT input"""
-    return f"""疾病資料：
+    history_text = ""
+    if history:
+        history_text = "先前對話摘要：\n" + "\n".join(history) + "\n\n"
+
+    return f"""{history_text}疾病資料：
 {paragraph}
 
 使用者症狀描述：
-{question}
+{question}"""
 
-請根據以上資訊，判斷是以下哪種情況並給出相應的 JSON 格式回答：
-1. 症狀與疾病資料相符 (type: matched)
-2. 找不到完全相符的症狀 (type: unmatched)
-3. 問題與疾病無關 (type: unrelated)
 
-注意：
-- 請仔細分析疾病資料中的臨床症狀、潛伏期、傳播方式和預防方法
-- 如果症狀相符，請提供完整的疾病資訊和預防建議
-- 如果症狀不相符，請列出需要補充的資訊和可能的其他疾病
-- 如果問題與疾病無關，請禮貌地引導使用者詢問健康相關問題""" 
\ No newline at end of file
+def fit_prompt_budget(
+    chunks: list[str],
+    history: list[str],
+    question: str,
+    budget: int,
+    system_prompt: str = MEDICAL_ADVISOR_SYSTEM_PROMPT,
+) -> tuple[list[str], list[str]]:
+    """Drop the oldest history, then the least relevant chunks, until the
+    whole prompt fits in `budget` tokens. At least one chunk is kept."""
+    chunks, history = list(chunks), list(history)
+
+    def total() -> int:
+        return estimate_tokens(system_prompt) + estimate_tokens(
+            format_medical_question("\n\n".join(chunks), question, history)
+        )
+
+    while history and total() > budget:
+        history.pop(0)
+    while len(chunks) > 1 and total() > budget:
+        chunks.pop()
+    return chunks, history
@@ -0,0 +1,65 @@
+"""Benchmark ASR backends on voice notes and report the real-time factor.
+
+RTF is transcription time divided by audio length; below 1.0 means faster
+than real time. Model loading is timed separately since the bot keeps the
+model loaded between requests.
+
+    python -m tools.bench_asr samples/*.m4a --backends google faster-whisper
+"""
+
+import argparse
+import time
+
+from dotenv import load_dotenv
+
+from utils.asr import create_asr_backend
+from utils.audio import audio_seconds, decode_audio, trim_silence
+
+
+def bench(backend_name: str, clips: dict, language: str, repeat: int):
+    start = time.perf_counter()
+    backend = create_asr_backend(backend_name)
+    print(f"[{backend_name}] model load: {time.perf_counter() - start:.2f}s")
+
+    total_audio = total_time = 0.0
+    for path, audio in clips.items():
+        seconds = audio_seconds(audio)
+        if seconds == 0:
+            # 整段都被當成靜音裁掉，沒有可以計算 RTF 的語音
+            print(f"  {path}: no speech after trimming silence, skipped")
+            continue
+        timings = []
+        text = ""
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                text = backend.transcribe(audio, language)
+            except Exception as e:
+                text = f"<error: {e}>"
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        total_audio += seconds
+        total_time += best
+        print(f"  {path}: {seconds:5.1f}s audio, {best:6.2f}s, RTF {best / seconds:.3f}  {text[:40]}")
+
+    if total_audio:
+        print(f"[{backend_name}] overall RTF {total_time / total_audio:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="+", help="audio files in any format ffmpeg reads")
+    parser.add_argument("--backends", nargs="+", default=["google"])
+    parser.add_argument("--language", default="zh-Hant")
+    parser.add_argument("--repeat", type=int, default=1, help="keep the best of N runs")
+    args = parser.parse_args()
+
+    load_dotenv()
+    clips = {}
+    for path in args.files:
+        with open(path, "rb") as f:
+            audio, _ = decode_audio(f.read())
+            clips[path] = trim_silence(audio)
+
+    for name in args.backends:
+        bench(name, clips, args.language, args.repeat)
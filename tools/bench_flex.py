@@ -0,0 +1,94 @@
+"""Benchmark Flex Message rendering against inline dict construction.
+
+The legacy path is rebuilt from the templates as the nested dict literal
+the handlers used to contain, then serialized with json.dumps, so both
+paths produce the same message. The reply columns add what it takes to
+turn the message into the body of a reply request: the SDK's model round
+trip versus the pre-serialized body sent by LineAPI.reply.
+
+    python -m tools.bench_flex --number 20000
+"""
+
+import argparse
+import json
+import os
+import re
+import timeit
+
+from utils.flex_templates import DEFAULT_TEMPLATE_DIR, FlexTemplateEngine, response_values
+from utils.line_api import flex_message, reply_body
+
+SAMPLES = {
+    "matched": {
+        "type": "matched",
+        "disease": "流行性感冒",
+        "symptoms": ["發燒", "咳嗽", "喉嚨痛", "肌肉痠痛"],
+        "suggestions": ["多休息", "多喝水", "症狀加劇時就醫"],
+        "additional_info": {
+            "incubation_period": "1-4 天",
+            "transmission": "飛沫傳染、接觸傳染",
+            "prevention": ["接種疫苗", "勤洗手", "戴口罩"],
+        },
+    },
+    "unmatched": {"type": "unmatched", "message": "請問您發燒幾天了？是否有其他症狀？"},
+    "unrelated": {"type": "unrelated", "message": "我是醫療諮詢助手，請詢問健康相關問題。"},
+}
+
+
+def legacy_builder(name: str, slots: tuple):
+    """Turn a template back into a function that builds it as a dict literal"""
+    with open(os.path.join(DEFAULT_TEMPLATE_DIR, f"{name}.json"), "r", encoding="utf-8") as f:
+        source = re.sub(r"'\{\{(\w+)\}\}'", r"\1", repr(json.load(f)))
+    namespace = {}
+    exec(f"def build({', '.join(slots)}):\n    return {source}", namespace)
+    return namespace["build"]
+
+
+def sdk_reply(contents: str) -> str:
+    """The SDK path: parse the contents into models, then serialize the request"""
+    from linebot.v3.messaging import FlexContainer, FlexMessage, ReplyMessageRequest
+
+    return ReplyMessageRequest(
+        replyToken="0" * 32,
+        messages=[FlexMessage(alt_text="醫療諮詢回覆", contents=FlexContainer.from_json(contents))],
+        notificationDisabled=False,
+    ).to_json()
+
+
+def fast_reply(engine: FlexTemplateEngine, response_data: dict) -> str:
+    contents = engine.render_response(response_data)
+    return reply_body("0" * 32, [flex_message("醫療諮詢回覆", contents)])
+
+
+def timed(func, number: int) -> float:
+    """Best time per call in microseconds"""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main(number: int):
+    engine = FlexTemplateEngine()
+
+    print(
+        f"{'type':<10} {'dict':>9} {'template':>9} {'speedup':>8} "
+        f"{'sdk reply':>10} {'fast reply':>10} {'speedup':>8}"
+    )
+    for label, response_data in SAMPLES.items():
+        name, values = response_values(response_data)
+        build = legacy_builder(name, engine.templates[name].slots)
+        assert json.loads(json.dumps(build(**values))) == json.loads(engine.render(name, **values))
+
+        legacy = timed(lambda: json.dumps(build(**values)), number)
+        rendered = timed(lambda: engine.render_response(response_data), number)
+        sdk = timed(lambda: sdk_reply(json.dumps(build(**values))), max(number // 20, 1))
+        fast = timed(lambda: fast_reply(engine, response_data), number)
+        print(
+            f"{label:<10} {legacy:7.1f}us {rendered:7.1f}us {legacy / rendered:7.1f}x "
+            f"{sdk:8.1f}us {fast:8.1f}us {sdk / fast:7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="renders per timing run")
+    args = parser.parse_args()
+    main(args.number)
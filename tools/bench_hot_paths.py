@@ -0,0 +1,228 @@
+"""Offline benchmarks of the bot's hot paths, saved as JSON to catch regressions.
+
+Covers chunking Markdown for the index, FAISS retrieval through
+AI.query_faiss with a stub embedder, Flex reply rendering and
+convert_to_flex_message, and audio decoding. Nothing calls the network.
+Each case reports the best time per call over five runs.
+
+    python -m tools.bench_hot_paths --output bench.json
+    python -m tools.bench_hot_paths --compare bench.json --tolerance 0.3
+
+Search indexes hold `size` x `dim` float32 vectors, so 1M vectors at the
+ada dimension need about 6 GB; use a smaller --dim on small machines.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import io
+import json
+import platform
+import shutil
+import sys
+import time
+import timeit
+import wave
+
+import faiss
+import numpy as np
+
+from ai import AI
+from md_to_faiss import chunk_text
+from tools.bench_flex import SAMPLES, fast_reply
+from utils.audio import decode_audio, parse_wav
+from utils.flex_message_converter import convert_to_flex_message
+from utils.flex_templates import FlexTemplateEngine
+from utils.index_store import Shard, load_metadata
+
+GROUPS = ("chunk", "search", "flex", "audio")
+
+
+class OfflineAI(AI):
+    """AI over the given shards whose query embeddings come from `queries`"""
+
+    def __init__(self, shards: list[Shard], queries: np.ndarray):
+        self.shards = {shard.name: shard for shard in shards}
+        self.search_pool = ThreadPoolExecutor(max_workers=len(shards))
+        self.queries = queries
+        self._next = 0
+
+    def embed(self, question: str) -> np.ndarray:
+        self._next = (self._next + 1) % len(self.queries)
+        return self.queries[self._next : self._next + 1]
+
+
+def timed(func) -> float:
+    """Best time per call in microseconds, with the count per run picked by timeit"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number * 1e6
+
+
+def random_vectors(rng: np.random.Generator, count: int, dim: int) -> np.ndarray:
+    vectors = rng.standard_normal((count, dim), dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def bench_chunk(results: dict, corpus_mb: list[float]):
+    sample = "\n\n".join(entry["content"] for entry in load_metadata("disease_metadata.pkl"))
+    for mb in corpus_mb:
+        # 依樣本的 UTF-8 長度換算成字數，讓語料約為 mb MB
+        chars = int(mb * 1024 * 1024 * len(sample) / len(sample.encode()))
+        corpus = (sample * (chars // len(sample) + 1))[:chars]
+        results[f"chunk_text[{mb:g}MB]"] = timed(lambda corpus=corpus: chunk_text(corpus))
+
+
+def sharded_search_case(
+    rng: np.random.Generator, queries: np.ndarray, size: int, dim: int, top_k: int, count: int
+) -> float:
+    """Time query_faiss over `size` vectors split into `count` shards.
+
+    The shards only live for the duration of this call, so one case's
+    vectors are freed before the next case builds its own.
+    """
+    metadata_entry = {"filename": "bench.md", "chunk_id": 0, "content": "x" * 300}
+    rows = size // count
+    shards = []
+    for i in range(count):
+        index = faiss.IndexFlatL2(dim)
+        # 分批產生，避免一次產生所有向量
+        for start in range(0, rows, 50_000):
+            index.add(random_vectors(rng, min(50_000, rows - start), dim))
+        shards.append(Shard(f"shard-{i}", index, [metadata_entry] * rows))
+    ai = OfflineAI(shards, queries)
+    try:
+        return timed(lambda: ai.query_faiss("", top_k))
+    finally:
+        ai.search_pool.shutdown()
+
+
+def bench_search(results: dict, sizes: list[int], dim: int, top_k: int, shard_counts: list[int]):
+    rng = np.random.default_rng(0)
+    queries = random_vectors(rng, 256, dim)
+    for size in sizes:
+        for shard_count in shard_counts:
+            results[f"query_faiss[{size}x{dim},k={top_k},shards={shard_count}]"] = (
+                sharded_search_case(rng, queries, size, dim, top_k, shard_count)
+            )
+
+
+def bench_flex(results: dict):
+    engine = FlexTemplateEngine()
+    for label, response_data in SAMPLES.items():
+        gpt_response = json.dumps(response_data, ensure_ascii=False)
+        results[f"flex_reply[{label}]"] = timed(
+            lambda response_data=response_data: fast_reply(engine, response_data)
+        )
+        results[f"convert_to_flex_message[{label}]"] = timed(
+            lambda gpt_response=gpt_response: convert_to_flex_message(gpt_response)
+        )
+
+
+def synthetic_clip(seconds: float = 10, sample_rate: int = 44100) -> bytes:
+    """A stereo WAV of a tone with noise, as a stand-in for a voice note"""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    rng = np.random.default_rng(0)
+    signal = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.05 * rng.standard_normal(len(t))
+    frames = (np.repeat(signal[:, None], 2, axis=1) * 32767).astype("<i2").tobytes()
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(frames)
+    return buffer.getvalue()
+
+
+def bench_audio(results: dict, clips: list[str]):
+    samples = {"synthetic-10s.wav": synthetic_clip()}
+    for path in clips:
+        with open(path, "rb") as f:
+            samples[path] = f.read()
+
+    wav = samples["synthetic-10s.wav"]
+    results["parse_wav[synthetic-10s.wav]"] = timed(lambda: parse_wav(wav))
+    if shutil.which("ffmpeg") is None:
+        print("ffmpeg not found, skipping decode_audio", file=sys.stderr)
+        return
+    for name, data in samples.items():
+        results[f"decode_audio[{name}]"] = timed(lambda data=data: decode_audio(data))
+
+
+def compare(baseline: dict, results: dict, tolerance: float) -> list[str]:
+    """Print both runs side by side and return the cases slower than the tolerance"""
+    regressions = []
+    print(f"{'case':<48} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    for case, current in results.items():
+        before = baseline.get(case)
+        if before is None:
+            print(f"{case:<48} {'-':>12} {current:10.1f}us")
+            continue
+        ratio = current / before
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(case)
+            flag = "  REGRESSION"
+        print(f"{case:<48} {before:10.1f}us {current:10.1f}us {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main(args) -> int:
+    results = {}
+    if "chunk" in args.groups:
+        bench_chunk(results, args.corpus_mb)
+    if "search" in args.groups:
+        bench_search(results, args.index_sizes, args.dim, args.top_k, args.index_shards)
+    if "flex" in args.groups:
+        bench_flex(results)
+    if "audio" in args.groups:
+        bench_audio(results, args.clips)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "faiss": faiss.__version__,
+                    "unit": "us",
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if not args.compare:
+        for case, us in results.items():
+            print(f"{case:<48} {us:10.1f}us")
+        return 0
+    with open(args.compare, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(baseline, results, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} case(s) slower than {1 + args.tolerance:.2f}x the baseline")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--groups", nargs="+", choices=GROUPS, default=list(GROUPS))
+    parser.add_argument("--corpus-mb", nargs="+", type=float, default=[1, 10])
+    parser.add_argument(
+        "--index-sizes", nargs="+", type=int, default=[1_000, 10_000, 100_000]
+    )
+    parser.add_argument("--dim", type=int, default=1536, help="embedding dimension")
+    parser.add_argument(
+        "--index-shards", nargs="+", type=int, default=[1], help="split each index into N shards"
+    )
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--clips", nargs="*", default=[], help="voice notes to decode")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON; exit 1 on a regression")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.3, help="allowed slowdown, 0.3 = 30%%"
+    )
+    args = parser.parse_args()
+    sys.exit(main(args))
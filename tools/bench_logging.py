@@ -0,0 +1,90 @@
+"""Benchmark the per-event cost of the bot's logging styles.
+
+Compares eager f-string messages with lazy %-style ones when the level is
+disabled, the text and JSON formatters when it is enabled, and logging a
+full webhook body against the sampled, redacted payload log. Output goes to
+os.devnull, so the numbers are the formatting cost alone.
+
+    python -m tools.bench_logging --number 20000
+"""
+
+import argparse
+import json
+import logging
+import os
+import timeit
+
+from tools.bench_flex import SAMPLES
+from utils import logs
+from utils.logs import JsonFormatter, TraceIdFilter, payload_sampled, redact_webhook_body
+
+BODY = json.dumps(
+    {
+        "destination": "U" + "0" * 32,
+        "events": [
+            {
+                "type": "message",
+                "mode": "active",
+                "timestamp": 1700000000000,
+                "source": {"type": "user", "userId": "U" + "1" * 32},
+                "replyToken": "0" * 32,
+                "message": {"id": "1", "type": "text", "text": "我發燒三天了，喉嚨很痛，還一直咳嗽，要看醫生嗎？"},
+            }
+        ],
+    },
+    ensure_ascii=False,
+)
+ANSWER = json.dumps(SAMPLES["matched"], ensure_ascii=False)
+
+
+def make_logger(name: str, level: int, formatter: logging.Formatter) -> logging.Logger:
+    handler = logging.StreamHandler(open(os.devnull, "w"))
+    handler.addFilter(TraceIdFilter())
+    handler.setFormatter(formatter)
+    logger = logging.getLogger(f"bench_logging.{name}")
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+
+def timed(func, number: int) -> float:
+    """Best time per call in microseconds"""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main(number: int, sample_rate: float):
+    text = logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(trace_id)s] %(message)s")
+    info = make_logger("info", logging.INFO, text)
+    debug = make_logger("debug", logging.DEBUG, text)
+    as_json = make_logger("json", logging.INFO, JsonFormatter())
+    logs._sample_rate = sample_rate
+
+    cases = [
+        ("debug off, f-string body", lambda: info.debug(f"Request body: {BODY}")),
+        ("debug off, lazy body", lambda: info.debug("Request body: %s", BODY)),
+        (
+            "debug off, sampled body",
+            lambda: payload_sampled(info) and info.debug("Request body: %s", BODY),
+        ),
+        ("info, f-string answer", lambda: info.info(f"Generated GPT response: {ANSWER}")),
+        ("info, text line", lambda: info.info("Text message %s, %d chars", "1", 28)),
+        ("info, json line", lambda: as_json.info("Text message %s, %d chars", "1", 28)),
+        ("debug on, full body", lambda: debug.debug("Request body: %s", BODY)),
+        (
+            f"debug on, sampled {sample_rate:.0%}",
+            lambda: payload_sampled(debug)
+            and debug.debug("Request body: %s", redact_webhook_body(BODY)),
+        ),
+    ]
+    print(f"{'case':<28} {'per call':>10}")
+    for label, func in cases:
+        print(f"{label:<28} {timed(func, number):8.2f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="calls per timing run")
+    parser.add_argument("--sample-rate", type=float, default=0.01, help="LOG_SAMPLE_RATE to model")
+    args = parser.parse_args()
+    main(args.number, args.sample_rate)
@@ -0,0 +1,69 @@
+"""Evaluate the intent pre-filter on a labelled TSV.
+
+Reports, for each confidence threshold, how many unrelated messages would
+skip GPT (recall), how many skipped messages were really unrelated
+(precision), how many medical messages were wrongly skipped, and the
+average classification time.
+
+    python -m tools.eval_intent --data data/intent_samples.tsv --model intent_model.pkl
+"""
+
+import argparse
+import time
+
+from tools.train_intent import load_samples, train
+from utils.intent_filter import IntentFilter
+
+
+def evaluate(intent_filter: IntentFilter, samples, thresholds):
+    predictions = []
+    start = time.perf_counter()
+    for _, text in samples:
+        predictions.append(intent_filter.classify(text))
+    elapsed = time.perf_counter() - start
+
+    print(f"average classification time: {elapsed / len(samples) * 1e6:.1f} µs")
+    print(f"{'threshold':>9} {'skipped':>8} {'precision':>9} {'recall':>7} {'false skips':>11}")
+    total_unrelated = sum(1 for label, _ in samples if label == "unrelated")
+    for threshold in thresholds:
+        skipped = true_skips = 0
+        for (label, _), (predicted, confidence) in zip(samples, predictions):
+            if predicted == "unrelated" and confidence >= threshold:
+                skipped += 1
+                true_skips += label == "unrelated"
+        precision = true_skips / skipped if skipped else 1.0
+        recall = true_skips / total_unrelated if total_unrelated else 0.0
+        print(
+            f"{threshold:>9.2f} {skipped:>8} {precision:>9.1%} {recall:>7.1%} "
+            f"{skipped - true_skips:>11}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default="data/intent_samples.tsv")
+    parser.add_argument("--model", help="trained model; omit to evaluate rules only")
+    parser.add_argument(
+        "--cross-validate",
+        type=int,
+        metavar="K",
+        help="train on K-1 folds of --data and evaluate on the remaining fold",
+    )
+    parser.add_argument(
+        "--thresholds", type=float, nargs="+", default=[0.5, 0.7, 0.8, 0.9, 0.95]
+    )
+    args = parser.parse_args()
+
+    samples = load_samples(args.data)
+    if args.cross_validate:
+        # 每一折都重新訓練，避免以訓練資料評估模型
+        folds = [samples[i :: args.cross_validate] for i in range(args.cross_validate)]
+        for i, fold in enumerate(folds):
+            intent_filter = IntentFilter()
+            intent_filter.model = train(
+                [s for j, f in enumerate(folds) if j != i for s in f]
+            )
+            print(f"--- fold {i + 1}/{args.cross_validate}")
+            evaluate(intent_filter, fold, args.thresholds)
+    else:
+        evaluate(IntentFilter(args.model), samples, args.thresholds)
@@ -0,0 +1,218 @@
+"""Evaluate retrieval quality and latency across chunk sizes, top_k and index types.
+
+Each labelled question names the file, and optionally the `##` section,
+that should answer it. For every configuration the corpus is chunked with
+md_to_faiss.chunk_text, embedded, indexed and searched the way AI.search
+does, and the tool reports:
+
+- recall@k: share of questions with a relevant chunk in the top k
+- MRR: mean reciprocal rank of the first relevant chunk
+- prompt tokens: average size of the GPT prompt built from the chunks
+- search time: mean FAISS search time per question
+
+The corpus is rebuilt from the metadata of the current index unless
+--markdown-dir is given. Embeddings are cached on disk, so only new chunks
+and questions call the OpenAI API.
+
+    python -m tools.eval_retrieval --chunk-sizes 200 300 500 --top-k 1 3 5 \
+        --index-types Flat HNSW32
+"""
+
+import argparse
+import csv
+import glob
+import hashlib
+import os
+import pickle
+import re
+import time
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+from openai import OpenAI
+
+from md_to_faiss import EMBEDDING_MODEL, chunk_text
+from prompts.medical_advisor import MEDICAL_ADVISOR_COMPACT_SYSTEM_PROMPT, format_medical_question
+from utils.index_store import load_metadata
+from utils.tokens import estimate_tokens
+
+_HEADING = re.compile(r"^#+\s*(.+?)\s*$", re.M)
+
+
+class EmbeddingCache:
+    """Normalised embeddings keyed by model and text, kept in a pickle file"""
+
+    def __init__(self, path: str, model: str = EMBEDDING_MODEL, batch_size: int = 100):
+        self.path = path
+        self.model = model
+        self.batch_size = batch_size
+        self.client = None
+        self.vectors: dict[str, np.ndarray] = {}
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                self.vectors = pickle.load(f)
+
+    def _key(self, text: str) -> str:
+        return hashlib.blake2b(f"{self.model}\0{text}".encode(), digest_size=16).hexdigest()
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        missing = {self._key(text): text for text in texts}
+        missing = [(key, text) for key, text in missing.items() if key not in self.vectors]
+        if missing:
+            self.client = self.client or OpenAI()
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start : start + self.batch_size]
+            response = self.client.embeddings.create(
+                input=[text for _, text in batch], model=self.model
+            )
+            for (key, _), item in zip(batch, response.data):
+                vector = np.array([item.embedding], dtype=np.float32)
+                faiss.normalize_L2(vector)
+                self.vectors[key] = vector[0]
+        if missing:
+            self.save()
+        return np.stack([self.vectors[self._key(text)] for text in texts])
+
+    def save(self) -> None:
+        with open(self.path, "wb") as f:
+            pickle.dump(self.vectors, f)
+
+
+def load_samples(path: str) -> list[tuple[str, str, str]]:
+    """Read (question, filename, section) rows; an empty section accepts the whole file"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [
+            (row["question"], row["filename"], (row.get("section") or "").strip())
+            for row in csv.DictReader(f, delimiter="\t")
+        ]
+
+
+def load_corpus(metadata_path: str, markdown_dir: str | None = None) -> dict[str, str]:
+    """Text per file, from Markdown files or joined back from the index metadata"""
+    corpus = {}
+    if markdown_dir:
+        for path in sorted(glob.glob(os.path.join(markdown_dir, "*.md"))):
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read().strip()
+            if len(content) >= 50:
+                corpus[os.path.basename(path)] = content
+        return corpus
+
+    metadata = load_metadata(metadata_path)
+    # chunk 之間沒有重疊，依順序接回去就是原文
+    for entry in sorted(metadata, key=lambda entry: (entry["filename"], entry["chunk_id"])):
+        corpus[entry["filename"]] = corpus.get(entry["filename"], "") + entry["content"]
+    return corpus
+
+
+def section_spans(text: str) -> dict[str, tuple[int, int]]:
+    """Character span of each `#` section, from its heading to the next one"""
+    headings = list(_HEADING.finditer(text))
+    ends = [match.start() for match in headings[1:]] + [len(text)]
+    return {match.group(1): (match.start(), end) for match, end in zip(headings, ends)}
+
+
+def build_chunks(corpus: dict[str, str], size: int) -> list[dict]:
+    chunks = []
+    for filename, text in corpus.items():
+        spans = section_spans(text)
+        for i, content in enumerate(chunk_text(text, size)):
+            start, end = i * size, i * size + len(content)
+            chunks.append(
+                {
+                    "filename": filename,
+                    "content": content,
+                    "sections": {
+                        title for title, (lo, hi) in spans.items() if lo < end and start < hi
+                    },
+                }
+            )
+    return chunks
+
+
+def build_index(index_type: str, vectors: np.ndarray):
+    index = faiss.index_factory(vectors.shape[1], index_type)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def relevant(chunk: dict, filename: str, section: str) -> bool:
+    return chunk["filename"] == filename and (not section or section in chunk["sections"])
+
+
+def evaluate(index, chunks, samples, query_vectors, top_k: int) -> dict:
+    hits = reciprocal_ranks = prompt_tokens = 0.0
+    search_time = 0.0
+    system_tokens = estimate_tokens(MEDICAL_ADVISOR_COMPACT_SYSTEM_PROMPT)
+    index.search(query_vectors[:1], top_k)  # 第一次搜尋較慢，不列入計時
+    for (question, filename, section), vector in zip(samples, query_vectors):
+        start = time.perf_counter()
+        _, ids = index.search(vector[None, :], top_k)
+        search_time += time.perf_counter() - start
+
+        retrieved = [chunks[i] for i in ids[0] if i >= 0]
+        for rank, chunk in enumerate(retrieved, 1):
+            if relevant(chunk, filename, section):
+                hits += 1
+                reciprocal_ranks += 1 / rank
+                break
+        paragraph = "\n\n".join(chunk["content"] for chunk in retrieved)
+        prompt_tokens += system_tokens + estimate_tokens(
+            format_medical_question(paragraph, question)
+        )
+
+    return {
+        "recall": hits / len(samples),
+        "mrr": reciprocal_ranks / len(samples),
+        "prompt_tokens": prompt_tokens / len(samples),
+        "search_us": search_time / len(samples) * 1e6,
+    }
+
+
+def main(args):
+    samples = load_samples(args.data)
+    corpus = load_corpus(args.metadata, args.markdown_dir)
+    cache = EmbeddingCache(args.cache, args.model)
+    query_vectors = cache.embed([question for question, _, _ in samples])
+
+    print(f"{len(samples)} questions over {len(corpus)} files")
+    print(
+        f"{'chunk':>5} {'chunks':>6} {'index':<12} {'k':>3} {'recall@k':>8} "
+        f"{'MRR':>6} {'prompt':>7} {'search':>9}"
+    )
+    for size in args.chunk_sizes:
+        chunks = build_chunks(corpus, size)
+        vectors = cache.embed([chunk["content"] for chunk in chunks])
+        for index_type in args.index_types:
+            index = build_index(index_type, vectors)
+            for top_k in args.top_k:
+                result = evaluate(index, chunks, samples, query_vectors, top_k)
+                print(
+                    f"{size:>5} {len(chunks):>6} {index_type:<12} {top_k:>3} "
+                    f"{result['recall']:>8.1%} {result['mrr']:>6.3f} "
+                    f"{result['prompt_tokens']:>7.0f} {result['search_us']:>7.1f}us"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default="data/retrieval_samples.tsv")
+    parser.add_argument("--metadata", default="disease_metadata.pkl")
+    parser.add_argument("--markdown-dir", help="chunk these Markdown files instead")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[200, 300, 500])
+    parser.add_argument("--top-k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument(
+        "--index-types",
+        nargs="+",
+        default=["Flat", "HNSW32"],
+        help="faiss.index_factory strings, e.g. Flat HNSW32 IVF4,Flat",
+    )
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--cache", default="embedding_cache.pkl")
+    args = parser.parse_args()
+
+    load_dotenv()
+    main(args)
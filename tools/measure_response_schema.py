@@ -0,0 +1,122 @@
+"""Compare GPT output size and latency of the full and compact response schemas.
+
+Offline (default): count the tokens of equivalent sample answers.
+Live (--live): ask GPT the README test questions with both system prompts
+and report the average completion tokens and latency per response type.
+
+    python -m tools.measure_response_schema
+    python -m tools.measure_response_schema --live --repeat 5
+"""
+
+import argparse
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+from prompts.medical_advisor import (
+    MEDICAL_ADVISOR_COMPACT_SYSTEM_PROMPT,
+    MEDICAL_ADVISOR_SYSTEM_PROMPT,
+    expand_compact_response,
+    format_medical_question,
+)
+from utils.tokens import estimate_tokens
+
+PARAGRAPH = "糖尿病是一種慢性代謝性疾病，主要特徵是血糖水平持續升高。常見症狀包括：多飲、多尿、多食、體重下降。治療方式包括：飲食控制、規律運動、口服藥物或胰島素注射。"
+
+QUESTIONS = {
+    "matched": "我最近常常口渴，喝很多水，也常常上廁所，體重也下降了。",
+    "unmatched": "我最近頭痛，而且會發燒到39度。",
+    "unrelated": "今天天氣如何？",
+}
+
+SAMPLES = {
+    "matched": {
+        "t": "m",
+        "d": "糖尿病",
+        "s": ["多飲", "多尿", "體重下降"],
+        "g": ["盡快就醫進行血糖檢查", "控制飲食，避免高糖食物", "保持規律運動"],
+        "n": 1,
+        "r": "m",
+        "i": "無",
+        "v": "不具傳染性",
+        "p": ["均衡飲食", "規律運動"],
+    },
+    "unmatched": {
+        "t": "u",
+        "m": "您描述的症狀（頭痛和高燒）需要更多資訊來判斷可能的疾病",
+        "q": ["頭痛的具體位置和性質", "發燒的持續時間", "是否有其他症狀"],
+        "g": ["提供更多症狀細節", "建議盡快就醫，因為高燒需要及時處理"],
+        "n": 1,
+        "r": "h",
+        "c": ["流行性感冒", "腦膜炎"],
+    },
+    "unrelated": {
+        "t": "x",
+        "m": "您好，我是一個醫療顧問，主要協助回答健康相關的問題",
+        "g": ["如果您有任何關於健康或疾病的問題，我很樂意為您解答"],
+    },
+}
+
+
+def measure_offline():
+    print(f"{'type':<10} {'full':>6} {'compact':>8} {'saved':>7}")
+    for response_type, compact in SAMPLES.items():
+        full = expand_compact_response(compact)
+        full_tokens = estimate_tokens(json.dumps(full, ensure_ascii=False, indent=4))
+        compact_tokens = estimate_tokens(
+            json.dumps(compact, ensure_ascii=False, separators=(",", ":"))
+        )
+        saved = 1 - compact_tokens / full_tokens
+        print(f"{response_type:<10} {full_tokens:>6} {compact_tokens:>8} {saved:>7.0%}")
+
+
+def measure_live(repeat: int, model: str):
+    from openai import OpenAI
+
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    prompts = {
+        "full": MEDICAL_ADVISOR_SYSTEM_PROMPT,
+        "compact": MEDICAL_ADVISOR_COMPACT_SYSTEM_PROMPT,
+    }
+
+    print(f"{'type':<10} {'schema':<8} {'tokens':>7} {'latency':>9}")
+    for response_type, question in QUESTIONS.items():
+        for schema, system_prompt in prompts.items():
+            tokens, latencies = [], []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {
+                            "role": "user",
+                            "content": format_medical_question(PARAGRAPH, question),
+                        },
+                    ],
+                    temperature=0.7,
+                    max_tokens=500,
+                    response_format={"type": "json_object"},
+                )
+                latencies.append(time.perf_counter() - start)
+                tokens.append(response.usage.completion_tokens)
+            print(
+                f"{response_type:<10} {schema:<8} {sum(tokens) / repeat:>7.1f} "
+                f"{sum(latencies) / repeat * 1000:>7.0f}ms"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--live", action="store_true", help="call the OpenAI API")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.live:
+        measure_live(args.repeat, args.model)
+    else:
+        measure_offline()
@@ -0,0 +1,194 @@
+"""Speech recognition backends, chosen with ASR_BACKEND.
+
+google          the free Google Web Speech endpoint used by speech_recognition
+faster-whisper  local CPU Whisper (`uv pip install faster-whisper`)
+vosk            local CPU Kaldi model (`uv pip install vosk` and a zh model)
+
+Local models are loaded once when the backend is created and reused for
+every request.
+"""
+
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import speech_recognition as sr
+
+from utils import tracing
+from utils.audio import audio_seconds, split_on_silence
+
+logger = logging.getLogger(__name__)
+
+
+# 這些語言的文字之間不加空白，分段辨識的結果直接接起來
+UNSPACED_LANGUAGES = ("zh", "cmn", "yue", "ja")
+
+
+def segment_separator(language: str) -> str:
+    """The text placed between the transcripts of consecutive segments"""
+    return "" if language.lower().split("-")[0] in UNSPACED_LANGUAGES else " "
+
+
+class ASRBackend(ABC):
+    name = ""
+
+    @abstractmethod
+    def transcribe(self, audio: sr.AudioData, language: str = "zh-Hant") -> str:
+        """The text spoken in `audio`; raises sr.UnknownValueError if there is none"""
+
+
+class GoogleASR(ASRBackend):
+    name = "google"
+
+    def __init__(self):
+        self.recognizer = sr.Recognizer()
+
+    def transcribe(self, audio: sr.AudioData, language: str = "zh-Hant") -> str:
+        return self.recognizer.recognize_google(audio, language=language)
+
+
+class FasterWhisperASR(ASRBackend):
+    name = "faster-whisper"
+
+    def __init__(
+        self,
+        model_size: str = "small",
+        compute_type: str = "int8",
+        cpu_threads: int = 0,
+        num_workers: int = 1,
+    ):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError as e:
+            raise RuntimeError(
+                "ASR_BACKEND=faster-whisper needs `uv pip install faster-whisper`"
+            ) from e
+
+        self.model = WhisperModel(
+            model_size,
+            device="cpu",
+            compute_type=compute_type,
+            cpu_threads=cpu_threads,
+            num_workers=num_workers,
+        )
+
+    def transcribe(self, audio: sr.AudioData, language: str = "zh-Hant") -> str:
+        pcm = audio.get_raw_data(convert_rate=16000, convert_width=2)
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        segments, _ = self.model.transcribe(
+            samples,
+            language=language.split("-")[0],
+            beam_size=1,
+            # Whisper 預設常輸出簡體中文，以提示引導為繁體
+            initial_prompt="以下是繁體中文的句子。" if language == "zh-Hant" else None,
+        )
+        return "".join(segment.text for segment in segments).strip()
+
+
+class VoskASR(ASRBackend):
+    name = "vosk"
+
+    def __init__(self, model_path: str):
+        try:
+            from vosk import KaldiRecognizer, Model, SetLogLevel
+        except ImportError as e:
+            raise RuntimeError("ASR_BACKEND=vosk needs `uv pip install vosk`") from e
+
+        SetLogLevel(-1)
+        self._recognizer_class = KaldiRecognizer
+        self.model = Model(model_path)
+
+    def transcribe(self, audio: sr.AudioData, language: str = "zh-Hant") -> str:
+        recognizer = self._recognizer_class(self.model, 16000)
+        recognizer.AcceptWaveform(audio.get_raw_data(convert_rate=16000, convert_width=2))
+        # Vosk 的中文模型以空白分隔每個字
+        return json.loads(recognizer.FinalResult()).get("text", "").replace(" ", "")
+
+
+class SegmentedTranscriber:
+    """Transcribes long audio as bounded segments in parallel.
+
+    Audio longer than `max_segment_seconds` is split at pauses, the
+    segments are sent to the backend concurrently (at most `parallelism` at
+    once) and the texts are joined in order. Each segment is retried on its
+    own, and a segment that still fails is dropped rather than losing the
+    whole message; only when every segment fails is the error raised.
+    """
+
+    def __init__(
+        self,
+        backend: ASRBackend,
+        parallelism: int = 4,
+        max_segment_seconds: float = 15.0,
+        retries: int = 2,
+    ):
+        self.backend = backend
+        self.max_segment_seconds = max_segment_seconds
+        self.retries = retries
+        self._executor = ThreadPoolExecutor(
+            max_workers=parallelism, thread_name_prefix="asr"
+        )
+
+    def _transcribe_segment(self, audio: sr.AudioData, language: str) -> str:
+        for attempt in range(self.retries + 1):
+            try:
+                with tracing.span(
+                    "asr_segment", seconds=round(audio_seconds(audio), 2), attempt=attempt
+                ):
+                    return self.backend.transcribe(audio, language)
+            except sr.UnknownValueError:
+                return ""  # 這段沒有可辨識的語音，重試也沒有用
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning("Retrying ASR segment after error: %s", e)
+                time.sleep(0.5 * 2**attempt)
+        return ""
+
+    def transcribe(self, audio: sr.AudioData, language: str = "zh-Hant") -> str:
+        segments = split_on_silence(audio, self.max_segment_seconds)
+        if len(segments) == 1:
+            texts = [self._transcribe_segment(audio, language)]
+        else:
+            # 帶著目前的 context，讓各段的 span 記在同一個 trace 底下
+            futures = [
+                self._executor.submit(
+                    contextvars.copy_context().run, self._transcribe_segment, segment, language
+                )
+                for segment in segments
+            ]
+            texts, errors = [], []
+            for i, future in enumerate(futures):
+                try:
+                    texts.append(future.result())
+                except Exception as e:
+                    logger.error("ASR segment %d/%d failed: %s", i + 1, len(segments), e)
+                    errors.append(e)
+            if len(errors) == len(segments):
+                raise errors[0]
+
+        text = segment_separator(language).join(t.strip() for t in texts if t.strip())
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+def create_asr_backend(name: str | None = None) -> ASRBackend:
+    name = name or os.getenv("ASR_BACKEND", "google")
+    if name == "google":
+        return GoogleASR()
+    if name == "faster-whisper":
+        return FasterWhisperASR(
+            model_size=os.getenv("WHISPER_MODEL", "small"),
+            compute_type=os.getenv("WHISPER_COMPUTE_TYPE", "int8"),
+            cpu_threads=int(os.getenv("WHISPER_CPU_THREADS", "0")),
+            num_workers=int(os.getenv("WHISPER_WORKERS", "1")),
+        )
+    if name == "vosk":
+        return VoskASR(os.getenv("VOSK_MODEL_PATH", "models/vosk-model-cn"))
+    raise ValueError(f"Unknown ASR backend: {name}")
@@ -0,0 +1,269 @@
+"""In-memory audio decoding for voice messages"""
+
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from dataclasses import dataclass
+import logging
+import re
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+
+import numpy as np
+import speech_recognition as sr
+
+logger = logging.getLogger(__name__)
+
+# 語音辨識只需要 16 kHz 單聲道
+TARGET_SAMPLE_RATE = 16000
+
+_STREAM_INFO = re.compile(r"Audio: .*?, (\d+) Hz, ([^,]+)")
+
+
+class AudioDecodeError(Exception):
+    pass
+
+
+class AudioQueueFull(Exception):
+    pass
+
+
+@dataclass
+class SourceInfo:
+    sample_rate: int
+    channels: int
+
+
+def _parse_source_info(stderr: str) -> SourceInfo | None:
+    """Sample rate and channel count of the input stream from ffmpeg's log"""
+    match = _STREAM_INFO.search(stderr)
+    if match is None:
+        return None
+    layout = match.group(2).strip()
+    if layout == "mono":
+        channels = 1
+    elif layout == "stereo":
+        channels = 2
+    else:
+        count = re.match(r"(\d+) channels", layout)
+        channels = int(count.group(1)) if count else 2
+    return SourceInfo(int(match.group(1)), channels)
+
+
+def _run_ffmpeg(
+    source: str, data: bytes | None, timeout: float, max_seconds: float | None = None
+) -> tuple[bytes, str]:
+    # info 等級的 log 會列出輸入串流的取樣率與聲道，用來計算省下的資料量
+    command = ["ffmpeg", "-hide_banner", "-loglevel", "info"]
+    if data is None:
+        command.append("-nostdin")
+    command += [
+        "-i", source,
+        "-vn", "-ac", "1", "-ar", str(TARGET_SAMPLE_RATE),
+        "-acodec", "pcm_s16le",
+    ]  # fmt: skip
+    if max_seconds is not None:
+        command += ["-t", str(max_seconds)]
+    command += ["-f", "wav", "pipe:1"]
+    process = subprocess.run(command, input=data, capture_output=True, timeout=timeout)
+    stderr = process.stderr.decode(errors="replace")
+    if process.returncode != 0 or not process.stdout:
+        raise AudioDecodeError(stderr.strip().splitlines()[-1] if stderr.strip() else "ffmpeg failed")
+    return process.stdout, stderr
+
+
+def parse_wav(data: bytes) -> tuple[bytes, int, int]:
+    """Return (pcm frames, sample rate, sample width) of a WAV byte string.
+
+    ffmpeg cannot seek back into a pipe to fill in the chunk sizes, so the
+    data chunk size may be a placeholder; the data runs to the end instead.
+    """
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise AudioDecodeError("ffmpeg did not produce a WAV stream")
+
+    sample_rate = sample_width = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset : offset + 4]
+        (chunk_size,) = struct.unpack("<I", data[offset + 4 : offset + 8])
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            _, _, sample_rate, _, _, bits = struct.unpack("<HHIIHH", data[body : body + 16])
+            sample_width = bits // 8
+        elif chunk_id == b"data":
+            end = min(body + chunk_size, len(data))
+            if sample_rate is None:
+                raise AudioDecodeError("WAV stream has no fmt chunk")
+            return data[body:end], sample_rate, sample_width
+        offset = body + chunk_size + (chunk_size & 1)
+    raise AudioDecodeError("WAV stream has no data chunk")
+
+
+def decode_audio(
+    data: bytes, timeout: float = 60, max_seconds: float | None = None
+) -> tuple[sr.AudioData, SourceInfo | None]:
+    """Decode an audio blob (m4a from LINE) into 16 kHz mono 16-bit PCM in memory.
+
+    The blob is streamed through ffmpeg's stdin and stdout. MP4 files whose
+    index (moov atom) sits at the end cannot be demuxed from a pipe; those
+    are retried from an anonymous temporary file that is removed on close.
+    Only the first `max_seconds` are decoded when it is set. Also returns
+    the sample rate and channel count of the source stream.
+    """
+    try:
+        wav, log = _run_ffmpeg("pipe:0", data, timeout, max_seconds)
+    except AudioDecodeError as e:
+        logger.info("Decoding from pipe failed, retrying from a temporary file: %s", e)
+        with tempfile.NamedTemporaryFile(prefix="m4a-") as tf:
+            tf.write(data)
+            tf.flush()
+            wav, log = _run_ffmpeg(tf.name, None, timeout, max_seconds)
+
+    pcm, sample_rate, sample_width = parse_wav(wav)
+    return sr.AudioData(pcm, sample_rate, sample_width), _parse_source_info(log)
+
+
+def audio_seconds(audio: sr.AudioData) -> float:
+    return len(audio.frame_data) / (audio.sample_rate * audio.sample_width)
+
+
+def frame_levels(audio: sr.AudioData, frame_ms: int = 30) -> np.ndarray:
+    """RMS level in dBFS of each `frame_ms` frame of 16-bit mono audio"""
+    samples = np.frombuffer(audio.frame_data, dtype=np.int16)
+    frame = max(audio.sample_rate * frame_ms // 1000, 1)
+    count = len(samples) // frame
+    if count == 0:
+        return np.empty(0, dtype=np.float32)
+    frames = samples[: count * frame].reshape(count, frame).astype(np.float32) / 32768.0
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20 * np.log10(rms + 1e-10)
+
+
+def trim_silence(
+    audio: sr.AudioData,
+    threshold_db: float = -40.0,
+    frame_ms: int = 30,
+    padding_ms: int = 200,
+) -> sr.AudioData:
+    """Cut leading and trailing frames quieter than `threshold_db`.
+
+    `padding_ms` of audio is kept around the speech so word onsets are not
+    clipped. Audio with no frame above the threshold becomes empty.
+    """
+    levels = frame_levels(audio, frame_ms)
+    if levels.size == 0:
+        return audio
+    voiced = np.flatnonzero(levels > threshold_db)
+    if voiced.size == 0:
+        return sr.AudioData(b"", audio.sample_rate, audio.sample_width)
+
+    frame_bytes = (audio.sample_rate * frame_ms // 1000) * audio.sample_width
+    padding = padding_ms // frame_ms
+    start = max(voiced[0] - padding, 0) * frame_bytes
+    end = min((voiced[-1] + padding + 1) * frame_bytes, len(audio.frame_data))
+    return sr.AudioData(audio.frame_data[start:end], audio.sample_rate, audio.sample_width)
+
+
+def split_on_silence(
+    audio: sr.AudioData, max_seconds: float = 15.0, frame_ms: int = 30
+) -> list[sr.AudioData]:
+    """Split audio into segments of at most `max_seconds`.
+
+    Each cut is placed at the quietest frame in the second half of the
+    allowed window, so segments end at pauses between words where there is
+    one and never exceed `max_seconds`.
+    """
+    if audio_seconds(audio) <= max_seconds:
+        return [audio]
+
+    levels = frame_levels(audio, frame_ms)
+    frame_bytes = (audio.sample_rate * frame_ms // 1000) * audio.sample_width
+    max_frames = max(int(max_seconds * 1000 // frame_ms), 2)
+
+    segments = []
+    start = 0
+    while len(levels) - start > max_frames:
+        window = levels[start + max_frames // 2 : start + max_frames]
+        cut = start + max_frames // 2 + int(np.argmin(window))
+        segments.append(audio.frame_data[start * frame_bytes : cut * frame_bytes])
+        start = cut
+    segments.append(audio.frame_data[start * frame_bytes :])
+    return [sr.AudioData(data, audio.sample_rate, audio.sample_width) for data in segments]
+
+
+@dataclass
+class DecodeResult:
+    audio: sr.AudioData
+    queue_wait: float
+    decode_time: float
+    # 若以原始取樣率與聲道輸出 WAV 的大小與長度，用來比較前處理省下多少
+    source_bytes: int
+    source_seconds: float
+
+
+class AudioDecodePool:
+    """Bounded pool for audio decoding, separate from the request threads.
+
+    Each job runs ffmpeg in its own process, so the pool threads only wait
+    on a child process; `max_workers` caps how many ffmpeg processes run at
+    once and `max_queue` caps how many decodes may wait for one. When the
+    queue is full `decode` raises AudioQueueFull instead of piling up.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_queue: int = 16,
+        timeout: float = 60,
+        silence_db: float | None = -40.0,
+    ):
+        self.timeout = timeout
+        self.silence_db = silence_db
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="audio-decode"
+        )
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+
+    def decode(self, data: bytes, max_seconds: float | None = None) -> DecodeResult:
+        if not self._slots.acquire(blocking=False):
+            raise AudioQueueFull("Too many voice messages are waiting to be decoded")
+        submitted = time.perf_counter()
+
+        def job() -> DecodeResult:
+            started = time.perf_counter()
+            try:
+                audio, source = decode_audio(data, self.timeout, max_seconds)
+                seconds = audio_seconds(audio)
+                source_bytes = len(audio.frame_data)
+                if self.silence_db is not None:
+                    audio = trim_silence(audio, self.silence_db)
+            except Exception:
+                # 在 worker 這裡記下 ffmpeg 的錯誤，呼叫端再決定如何回覆使用者
+                logger.exception(
+                    "Decoding %d bytes of audio failed after %.0fms",
+                    len(data),
+                    (time.perf_counter() - started) * 1000,
+                )
+                raise
+            finally:
+                self._slots.release()
+
+            if source is not None:
+                source_bytes = int(seconds * source.sample_rate * source.channels * 2)
+            return DecodeResult(
+                audio,
+                queue_wait=started - submitted,
+                decode_time=time.perf_counter() - started,
+                source_bytes=source_bytes,
+                source_seconds=seconds,
+            )
+
+        try:
+            # 帶著目前的 context，worker 的 log 才會有這個事件的 trace id
+            future = self._executor.submit(contextvars.copy_context().run, job)
+        except RuntimeError:
+            self._slots.release()
+            raise
+        return future.result()
@@ -0,0 +1,61 @@
+"""Admission policy for voice messages, decided from LINE metadata before download"""
+
+from dataclasses import dataclass
+
+ACCEPT = "accept"
+TRIM = "trim"
+REJECT = "reject"
+EMPTY = "empty"
+
+
+class AudioTooLarge(Exception):
+    pass
+
+
+@dataclass
+class Admission:
+    action: str
+    # 超過長度上限而裁切時，只解碼前 max_seconds 秒
+    max_seconds: float | None = None
+    # 長語音改走較快的辨識路徑
+    fast: bool = False
+
+
+class AudioAdmissionPolicy:
+    """Decides what to do with a voice message from its `duration`.
+
+    Clips shorter than `min_ms` are treated as empty and never downloaded.
+    Clips longer than `max_ms` are either rejected or trimmed to `max_ms`,
+    depending on `oversize`. Clips longer than `fast_path_ms` use the fast
+    ASR path. `max_bytes` caps the size of the download itself.
+    """
+
+    def __init__(
+        self,
+        min_ms: int = 500,
+        max_ms: int = 60_000,
+        oversize: str = TRIM,
+        fast_path_ms: int = 20_000,
+        max_bytes: int = 10 * 1024 * 1024,
+    ):
+        if oversize not in (TRIM, REJECT):
+            raise ValueError(f"oversize must be {TRIM!r} or {REJECT!r}, not {oversize!r}")
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.oversize = oversize
+        self.fast_path_ms = fast_path_ms
+        self.max_bytes = max_bytes
+
+    def admit(self, duration_ms: int | None) -> Admission:
+        if duration_ms is None:
+            # LINE 沒有提供長度時照常處理，仍受 max_bytes 限制
+            return Admission(ACCEPT)
+        if duration_ms < self.min_ms:
+            return Admission(EMPTY)
+
+        fast = duration_ms > self.fast_path_ms
+        if duration_ms <= self.max_ms:
+            return Admission(ACCEPT, fast=fast)
+        if self.oversize == REJECT:
+            return Admission(REJECT)
+        return Admission(TRIM, max_seconds=self.max_ms / 1000, fast=fast)
@@ -0,0 +1,112 @@
+"""Local nearest-clinic index over NumPy arrays, built by tools/import_clinics.py"""
+
+import math
+
+import numpy as np
+
+from utils.geohash import EARTH_RADIUS_M
+
+# 每度緯度約 111.32 公里
+METERS_PER_DEGREE = 111_320
+
+
+def haversine_m(lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """Great-circle distance in metres from one point to many"""
+    phi1 = math.radians(lat)
+    phi2 = np.radians(lats)
+    a = (
+        np.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lngs - lng) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+class ClinicIndex:
+    """Clinics bucketed into a lat/lng grid for nearest-k lookups.
+
+    Clinics are sorted by grid cell so each cell is a contiguous slice of
+    the coordinate arrays. A lookup gathers the cells that can hold a
+    clinic within `radius`, computes their distances in one vectorised
+    pass and keeps the `k` nearest.
+    """
+
+    def __init__(
+        self,
+        lats: np.ndarray,
+        lngs: np.ndarray,
+        names: np.ndarray,
+        addresses: np.ndarray,
+        cell_deg: float = 0.02,
+    ):
+        self.cell_deg = cell_deg
+        rows = np.floor(np.asarray(lats, dtype=np.float64) / cell_deg).astype(np.int64)
+        cols = np.floor(np.asarray(lngs, dtype=np.float64) / cell_deg).astype(np.int64)
+        order = np.lexsort((cols, rows))
+
+        self.lats = np.asarray(lats, dtype=np.float64)[order]
+        self.lngs = np.asarray(lngs, dtype=np.float64)[order]
+        self.names = np.asarray(names)[order]
+        self.addresses = np.asarray(addresses)[order]
+
+        # 每個格子對應排序後陣列中的一段 [start, end)
+        rows, cols = rows[order], cols[order]
+        self._cells: dict[tuple[int, int], tuple[int, int]] = {}
+        if len(order):
+            starts = np.flatnonzero(
+                np.r_[True, (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])]
+            )
+            ends = np.r_[starts[1:], len(order)]
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                self._cells[(int(rows[start]), int(cols[start]))] = (start, end)
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    @classmethod
+    def load(cls, path: str, cell_deg: float = 0.02) -> "ClinicIndex":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["lat"], data["lng"], data["name"], data["address"], cell_deg)
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(
+            path, lat=self.lats, lng=self.lngs, name=self.names, address=self.addresses
+        )
+
+    def _candidates(self, lat: float, lng: float, radius: float) -> np.ndarray:
+        lat_span = radius / METERS_PER_DEGREE
+        lng_span = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        row_lo = math.floor((lat - lat_span) / self.cell_deg)
+        row_hi = math.floor((lat + lat_span) / self.cell_deg)
+        col_lo = math.floor((lng - lng_span) / self.cell_deg)
+        col_hi = math.floor((lng + lng_span) / self.cell_deg)
+
+        slices = [
+            np.arange(*self._cells[(row, col)])
+            for row in range(row_lo, row_hi + 1)
+            for col in range(col_lo, col_hi + 1)
+            if (row, col) in self._cells
+        ]
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def nearest(self, lat: float, lng: float, k: int = 5, radius: float = 2000) -> list[dict]:
+        """The `k` nearest clinics within `radius` metres, nearest first"""
+        candidates = self._candidates(lat, lng, radius)
+        if not len(candidates):
+            return []
+
+        distances = haversine_m(lat, lng, self.lats[candidates], self.lngs[candidates])
+        within = np.flatnonzero(distances <= radius)
+        if len(within) > k:
+            within = within[np.argpartition(distances[within], k)[:k]]
+        within = within[np.argsort(distances[within])]
+
+        return [
+            {
+                "name": str(self.names[candidates[i]]),
+                "address": str(self.addresses[candidates[i]]),
+                "lat": float(self.lats[candidates[i]]),
+                "lng": float(self.lngs[candidates[i]]),
+                "distance": round(float(distances[i])),
+            }
+            for i in within
+        ]
@@ -0,0 +1,19 @@
+"""JSON encoding for the reply path.
+
+The standard json module is used by default. orjson is not a declared
+dependency; installing it (`uv pip install orjson`) makes encoding faster.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+
+def dumps(value) -> str:
+    """Compact JSON with non-ASCII text left unescaped"""
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,97 @@
+"""Flex Message templates compiled once and rendered by substituting values"""
+
+import json
+import os
+import re
+
+from utils.fast_json import dumps
+
+# 整個字串值為 "{{name}}" 的欄位即為插槽
+_SLOT = re.compile(r'"\{\{(\w+)\}\}"')
+
+DEFAULT_TEMPLATE_DIR = "template"
+
+
+class FlexTemplate:
+    """A JSON template pre-serialized into static text and named slots.
+
+    Any JSON string value of the form "{{name}}" is a slot. Rendering
+    serializes only the slot values and joins them with the static text,
+    so the template itself is never copied or re-encoded per message.
+    Slot values may be any JSON value, not just strings.
+    """
+
+    def __init__(self, template: dict):
+        text = json.dumps(template, ensure_ascii=False, separators=(",", ":"))
+        parts = _SLOT.split(text)
+        # split 結果為 [靜態, 插槽, 靜態, 插槽, ..., 靜態]
+        self._static = parts[0::2]
+        self.slots = tuple(parts[1::2])
+
+    def render(self, **values) -> str:
+        out = [self._static[0]]
+        for name, static in zip(self.slots, self._static[1:]):
+            out.append(dumps(values[name]))
+            out.append(static)
+        return "".join(out)
+
+
+class FlexTemplateEngine:
+    """Loads every template/*.json once at startup."""
+
+    def __init__(self, directory: str = DEFAULT_TEMPLATE_DIR):
+        self.templates: dict[str, FlexTemplate] = {}
+        for filename in sorted(os.listdir(directory)):
+            name, ext = os.path.splitext(filename)
+            if ext == ".json":
+                with open(os.path.join(directory, filename), "r", encoding="utf-8") as f:
+                    self.templates[name] = FlexTemplate(json.load(f))
+
+    def render(self, name: str, **values) -> str:
+        return self.templates[name].render(**values)
+
+    def render_response(self, response_data: dict) -> str:
+        """Render a medical advisor response as Flex Message JSON"""
+        name, values = response_values(response_data)
+        return self.render(name, **values)
+
+
+def _joined(items, default: str) -> str:
+    return "、".join(str(item) for item in items) if items else default
+
+
+def _text(value, default: str) -> str:
+    return str(value).strip() or default
+
+
+def response_values(response_data: dict) -> tuple[str, dict]:
+    """Pick the reply template for a response and the values for its slots"""
+    response_type = response_data.get("type")
+    if response_type == "matched":
+        additional_info = response_data.get("additional_info") or {}
+        return "matched_reply", {
+            "disease": _text(response_data.get("disease", ""), "無法確定可能的疾病"),
+            "symptoms": _joined(response_data.get("symptoms"), "無法確定相關症狀"),
+            "suggestions": _joined(response_data.get("suggestions"), "建議盡快就醫"),
+            "incubation_period": _text(additional_info.get("incubation_period", ""), "未知"),
+            "transmission": _text(additional_info.get("transmission", ""), "未知"),
+            "prevention": _joined(additional_info.get("prevention"), "未知"),
+        }
+    if response_type == "unmatched":
+        return "unmatched_reply", {
+            "message": _text(response_data.get("message", ""), "需要更多資訊來協助您"),
+        }
+    return "unrelated_reply", {
+        "message": _text(response_data.get("message", ""), "抱歉，我無法理解您的問題"),
+    }
+
+
+_engine: FlexTemplateEngine | None = None
+
+
+def default_engine() -> FlexTemplateEngine:
+    """Shared engine over the bundled templates, loaded on first use"""
+    global _engine
+    if _engine is None:
+        _engine = FlexTemplateEngine()
+    return _engine
@@ -0,0 +1,68 @@
+"""Geohash cells and great-circle distance for location lookups"""
+
+import math
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+EARTH_RADIUS_M = 6_371_000
+
+
+def encode(lat: float, lng: float, precision: int = 6) -> str:
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        # 偶數位元切經度，奇數位元切緯度
+        value, bounds = (lng, lng_range) if even else (lat, lat_range)
+        mid = (bounds[0] + bounds[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            bounds[0] = mid
+        else:
+            bits = bits * 2
+            bounds[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def bounds(geohash: str) -> tuple[float, float, float, float]:
+    """(south, west, north, east) of a geohash cell"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = _BASE32.index(char)
+        for shift in range(4, -1, -1):
+            span = lng_range if even else lat_range
+            mid = (span[0] + span[1]) / 2
+            if bits >> shift & 1:
+                span[0] = mid
+            else:
+                span[1] = mid
+            even = not even
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+
+def center(geohash: str) -> tuple[float, float]:
+    south, west, north, east = bounds(geohash)
+    return (south + north) / 2, (west + east) / 2
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in metres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def cell_radius_m(geohash: str) -> float:
+    """Distance from a cell's centre to its farthest corner"""
+    south, west, north, east = bounds(geohash)
+    lat, lng = center(geohash)
+    # 靠近赤道那一側的東西向跨距較長，其角落離中心最遠
+    corner_lat = south if abs(south) < abs(north) else north
+    return haversine_m(lat, lng, corner_lat, east)
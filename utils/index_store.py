@@ -0,0 +1,154 @@
+"""Reading and writing the FAISS index shards and chunk metadata built by md_to_faiss.py"""
+
+from concurrent.futures import Executor
+from dataclasses import dataclass
+import json
+import os
+import pickle
+import zlib
+
+import faiss
+import numpy as np
+
+# chunk 以 (shard 名稱, 該 shard 的列號) 識別
+ChunkId = tuple[str, int]
+
+
+def load_metadata(path: str) -> list[dict]:
+    """Chunk metadata, in index row order.
+
+    The file is a stream of pickled lists, one per build batch. Older
+    builds wrote a single list, which reads the same way.
+    """
+    metadata = []
+    with open(path, "rb") as f:
+        while True:
+            try:
+                metadata.extend(pickle.load(f))
+            except EOFError:
+                return metadata
+
+
+def count_metadata(path: str) -> int:
+    """Number of entries in a metadata file, without keeping them in memory"""
+    count = 0
+    with open(path, "rb") as f:
+        while True:
+            try:
+                count += len(pickle.load(f))
+            except EOFError:
+                return count
+
+
+class MetadataWriter:
+    """Appends metadata batches to a temporary file that replaces `path` on commit.
+
+    To resume an interrupted build, pass the `offset` and `count` recorded
+    by flush(); anything written after that point is discarded.
+    """
+
+    def __init__(
+        self, path: str, tmp_path: str | None = None, offset: int | None = None, count: int = 0
+    ):
+        self.path = path
+        self.count = count
+        self._tmp_path = tmp_path or f"{path}.tmp"
+        if offset is None:
+            self._file = open(self._tmp_path, "wb")
+        else:
+            self._file = open(self._tmp_path, "r+b")
+            self._file.truncate(offset)
+            self._file.seek(offset)
+
+    def write(self, entries: list[dict]) -> None:
+        pickle.dump(entries, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.count += len(entries)
+
+    def flush(self) -> int:
+        """Write the batches so far to disk and return the offset to resume from"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def commit(self) -> None:
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self) -> None:
+        self._file.close()
+        os.remove(self._tmp_path)
+
+
+@dataclass
+class Shard:
+    name: str
+    index: faiss.Index
+    metadata: list[dict]
+
+
+def load_shard(name: str, index_path: str, metadata_path: str) -> Shard:
+    index = faiss.read_index(index_path)
+    metadata = load_metadata(metadata_path)
+    if index.ntotal != len(metadata):
+        raise ValueError(
+            f"Shard {name}: index has {index.ntotal} rows but metadata has {len(metadata)}"
+        )
+    return Shard(name, index, metadata)
+
+
+def shard_of(filename: str, count: int) -> int:
+    """Stable hash shard for a file, the same in every process and run"""
+    return zlib.crc32(filename.encode()) % count
+
+
+def load_manifest(path: str) -> dict[str, dict]:
+    """Shard name -> {"index": path, "metadata": path}, paths relative to the manifest"""
+    with open(path, "r", encoding="utf-8") as f:
+        shards = json.load(f)["shards"]
+    base = os.path.dirname(os.path.abspath(path))
+    return {
+        name: {key: os.path.join(base, entry[key]) for key in ("index", "metadata")}
+        for name, entry in shards.items()
+    }
+
+
+def update_manifest(path: str, name: str, index_path: str, metadata_path: str) -> None:
+    """Add or replace one shard in the manifest, leaving the others as they are"""
+    shards = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            shards = json.load(f)["shards"]
+    base = os.path.dirname(os.path.abspath(path))
+    shards[name] = {
+        "index": os.path.relpath(os.path.abspath(index_path), base),
+        "metadata": os.path.relpath(os.path.abspath(metadata_path), base),
+    }
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"shards": dict(sorted(shards.items()))}, f, ensure_ascii=False, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def search_shards(
+    shards: list[Shard], query: np.ndarray, top_k: int, executor: Executor | None = None
+) -> list[ChunkId]:
+    """The `top_k` nearest chunks over all shards, nearest first.
+
+    Each shard is searched for its own top_k and the results are merged by
+    distance. FAISS releases the GIL while searching, so with an executor
+    the shards are searched in parallel.
+    """
+
+    def search(shard: Shard):
+        distances, rows = shard.index.search(query, top_k)
+        return [
+            (float(distance), shard.name, int(row))
+            for distance, row in zip(distances[0], rows[0])
+            if row >= 0
+        ]
+
+    if executor is None or len(shards) == 1:
+        results = [search(shard) for shard in shards]
+    else:
+        results = list(executor.map(search, shards))
+    merged = sorted(hit for hits in results for hit in hits)[:top_k]
+    return [(name, row) for _, name, row in merged]
@@ -0,0 +1,78 @@
+"""Local pre-filter for greetings, thanks and other non-medical chatter.
+
+Obvious chatter is answered with UNRELATED_RESPONSE without calling the
+embedding API or GPT. Rules run first; an optional character n-gram
+logistic regression (see tools/train_intent.py) handles the rest.
+"""
+
+import logging
+import os
+import pickle
+import re
+
+logger = logging.getLogger(__name__)
+
+UNRELATED_RESPONSE = {
+    "type": "unrelated",
+    "title": "問題與疾病無關",
+    "message": "您好，我是醫療顧問小幫手，主要協助回答健康相關的問題。",
+    "suggestions": ["如果您有任何關於健康或疾病的問題，歡迎直接描述您的症狀"],
+}
+
+# 出現這些字就一定交給 GPT，避免把症狀描述誤判為閒聊
+_MEDICAL_HINTS = re.compile(
+    r"痛|燒|咳|癢|吐|瀉|腫|疹|暈|喘|病|症|醫|藥|診|傷|血|痰|膿|炎|疫|菌|毒|"
+    r"感冒|過敏|不舒服|痠|麻|鼻|喉|肚子|胸|頭|眼|耳|皮膚|疲|累|失眠|懷孕|"
+    r"pain|hurt|fever|cough|sick|ill|doctor|covid|flu",
+    re.IGNORECASE,
+)
+
+_PUNCT = r"[\s!！~～。.,，？?…]*"
+
+_CHATTER_RULES = [
+    # 打招呼
+    re.compile(rf"^(你好|您好|哈囉|哈嘍|嗨|安安|早安|午安|晚安|早|hi|hello|hey|yo){_PUNCT}$", re.IGNORECASE),
+    # 道謝
+    re.compile(rf"^(謝謝|感謝|多謝|感恩|謝啦|謝了|thx|thanks|thank you|3q){_PUNCT}(你|您)?{_PUNCT}$", re.IGNORECASE),
+    # 道別
+    re.compile(rf"^(掰掰|拜拜|再見|bye|bye bye|886){_PUNCT}$", re.IGNORECASE),
+    # 簡短回應
+    re.compile(rf"^(好|好的|好喔|好哦|嗯|嗯嗯|恩|喔|哦|收到|了解|知道了|ok|okay|沒事|沒問題){_PUNCT}$", re.IGNORECASE),
+    # 笑聲
+    re.compile(rf"^(哈+|呵+|嘻+|lol|XD+|笑死){_PUNCT}$", re.IGNORECASE),
+    # 以文字送出的貼圖或表情，例如 (emoji)、[貼圖]、[Sticker]
+    re.compile(r"^(\s*[\(\[（［][^\)\]）］]{1,12}[\)\]）］]\s*)+$"),
+    # 只有表情符號或標點
+    re.compile(r"^[\W_]+$"),
+]
+
+
+class IntentFilter:
+    def __init__(self, model_path: str | None = None, threshold: float = 0.9):
+        self.threshold = threshold
+        self.model = None
+        if model_path and os.path.exists(model_path):
+            with open(model_path, "rb") as f:
+                self.model = pickle.load(f)
+            logger.info("Loaded intent model from %s", model_path)
+
+    def classify(self, text: str) -> tuple[str, float]:
+        """Return ("unrelated" | "medical" | "unknown", confidence)"""
+        text = text.strip()
+        if not text:
+            return "unrelated", 1.0
+        if _MEDICAL_HINTS.search(text):
+            return "medical", 1.0
+        if any(rule.match(text) for rule in _CHATTER_RULES):
+            return "unrelated", 1.0
+        if self.model is None:
+            return "unknown", 0.0
+
+        p_unrelated = float(self.model.predict_proba([text])[0][1])
+        if p_unrelated >= 0.5:
+            return "unrelated", p_unrelated
+        return "medical", 1 - p_unrelated
+
+    def is_unrelated(self, text: str) -> bool:
+        label, confidence = self.classify(text)
+        return label == "unrelated" and confidence >= self.threshold
@@ -0,0 +1,120 @@
+"""Thin LINE Messaging API client for the hot paths the SDK makes slow"""
+
+import logging
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.audio_admission import AudioTooLarge
+from utils.fast_json import dumps
+from utils.logs import payload_sampled, redact
+from utils.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+
+def text_message(text: str) -> str:
+    return f'{{"type":"text","text":{dumps(text)}}}'
+
+
+def flex_message(alt_text: str, contents: str) -> str:
+    """A Flex Message around `contents`, already serialized to JSON"""
+    return f'{{"type":"flex","altText":{dumps(alt_text)},"contents":{contents}}}'
+
+
+def reply_body(reply_token: str, messages: list[str]) -> str:
+    return (
+        f'{{"replyToken":{dumps(reply_token)},'
+        f'"messages":[{",".join(messages)}],"notificationDisabled":false}}'
+    )
+
+
+class LineAPI:
+    """Sends replies and downloads message content over pooled connections.
+
+    The SDK's MessagingApiBlob always talks to https://api-data.line.me;
+    this client honours LINE_DATA_API_HOST so the bot can run against the
+    local stand-ins in loadtest/.
+
+    Replies are posted as pre-serialized JSON instead of going through the
+    SDK's pydantic models, which would parse the Flex contents back into
+    objects only to serialize them again. With `validate` set, the request
+    is still checked against those models before it is sent.
+    """
+
+    def __init__(
+        self,
+        access_token: str | None,
+        data_host: str | None = None,
+        api_host: str | None = None,
+        pool_size: int = 10,
+        validate: bool = False,
+    ):
+        self.data_host = (
+            data_host or os.getenv("LINE_DATA_API_HOST") or "https://api-data.line.me"
+        ).rstrip("/")
+        self.api_host = (
+            api_host or os.getenv("LINE_API_HOST") or "https://api.line.me"
+        ).rstrip("/")
+        self.validate = validate
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Authorization"] = f"Bearer {access_token}"
+
+    def reply(self, reply_token: str, messages: list[str], timeout: float = 10) -> None:
+        """Send messages built with text_message() / flex_message() as a reply"""
+        body = reply_body(reply_token, messages)
+        if self.validate:
+            from linebot.v3.messaging import ReplyMessageRequest
+
+            ReplyMessageRequest.from_json(body)
+        if payload_sampled(logger):
+            # 回覆內容通常重述使用者的症狀，與問題一樣遮蔽
+            logger.debug("Reply request: %s", redact(body))
+
+        with stage("reply", upstream="line"):
+            response = self.session.post(
+                f"{self.api_host}/v2/bot/message/reply",
+                data=body.encode(),
+                headers={"Content-Type": "application/json"},
+                timeout=timeout,
+            )
+            if response.status_code != 200:
+                raise requests.HTTPError(
+                    f"LINE reply failed with {response.status_code}: {response.text}",
+                    response=response,
+                )
+
+    def get_message_content(
+        self, message_id: str, timeout: float = 30, max_bytes: int | None = None
+    ) -> bytes:
+        """Download message content, refusing anything over `max_bytes`.
+
+        The Content-Length header is checked before the body is read, and the
+        body is read in chunks so a missing or wrong header cannot bypass it.
+        """
+        # 超過上限不算 LINE 的錯誤，離開 stage 之後才丟出
+        too_large = None
+        with stage("download", upstream="line"), self.session.get(
+            f"{self.data_host}/v2/bot/message/{message_id}/content",
+            timeout=timeout,
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            length = response.headers.get("Content-Length")
+            content = bytearray()
+            if max_bytes is not None and length and int(length) > max_bytes:
+                too_large = f"Message content is {length} bytes"
+            else:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    content += chunk
+                    if max_bytes is not None and len(content) > max_bytes:
+                        too_large = f"Message content exceeds {max_bytes} bytes"
+                        break
+
+        if too_large:
+            raise AudioTooLarge(too_large)
+        return bytes(content)
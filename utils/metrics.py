@@ -0,0 +1,151 @@
+"""Prometheus metrics for the webhook pipeline, served at /metrics.
+
+Events and stages are also recorded as trace spans, see utils.tracing.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+from utils import tracing
+
+# 大部分階段落在數毫秒到數秒之間；GPT 與語音辨識可能更久
+_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+EVENT_SECONDS = Histogram(
+    "linebot_event_seconds",
+    "Time to handle a webhook event, from dispatch to reply",
+    ["handler"],
+    buckets=_BUCKETS,
+)
+EVENTS = Counter(
+    "linebot_events_total",
+    "Webhook events handled, by outcome",
+    ["handler", "outcome"],
+)
+STAGE_SECONDS = Histogram(
+    "linebot_stage_seconds",
+    "Time spent in each pipeline stage",
+    ["handler", "stage"],
+    buckets=_BUCKETS,
+)
+UPSTREAM_ERRORS = Counter(
+    "linebot_upstream_errors_total",
+    "Failed calls to upstream services",
+    ["service"],
+)
+IN_FLIGHT = Gauge(
+    "linebot_in_flight_events",
+    "Webhook events being handled",
+    ["handler"],
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "linebot_upstream_in_flight",
+    "Calls waiting on an upstream service",
+    ["service"],
+)
+CLINIC_CACHE = Counter(
+    "linebot_clinic_cache_total",
+    "Nearby clinic lookups, by whether the geohash cell was cached",
+    ["result"],
+)
+
+_handler: ContextVar[str] = ContextVar("metrics_handler", default="other")
+_failed: ContextVar[list[bool] | None] = ContextVar("metrics_failed", default=None)
+
+
+@contextmanager
+def track_event(handler: str):
+    """Time a webhook event; stages inside it are labelled with `handler`.
+
+    The event counts as an error if it raises or if the handler calls
+    mark_event_failed() after replying with an apology.
+    """
+    handler_token = _handler.set(handler)
+    failed = [False]
+    failed_token = _failed.set(failed)
+    IN_FLIGHT.labels(handler).inc()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        failed[0] = True
+        raise
+    finally:
+        EVENT_SECONDS.labels(handler).observe(time.perf_counter() - start)
+        EVENTS.labels(handler, "error" if failed[0] else "ok").inc()
+        IN_FLIGHT.labels(handler).dec()
+        _failed.reset(failed_token)
+        _handler.reset(handler_token)
+
+
+def tracked(handler: str):
+    """Decorate a LINE event handler with track_event and a trace.
+
+    The wrapper keeps the single `event` argument, since the SDK picks how to
+    call a handler from its argument spec.
+    """
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(event):
+            message = getattr(event, "message", None)
+            with tracing.start_trace(
+                handler, message_id=getattr(message, "id", None)
+            ), track_event(handler):
+                return func(event)
+
+        return wrapper
+
+    return decorate
+
+
+def mark_event_failed(error: Exception) -> None:
+    failed = _failed.get()
+    if failed is not None:
+        failed[0] = True
+    tracing.mark_failed(error)
+
+
+@contextmanager
+def stage(name: str, upstream: str | None = None):
+    """Time a pipeline stage as a metric and a span, which is yielded.
+
+    An exception also counts as an `upstream` error.
+    """
+    if upstream:
+        UPSTREAM_IN_FLIGHT.labels(upstream).inc()
+    start = time.perf_counter()
+    try:
+        with tracing.span(name, **({"upstream": upstream} if upstream else {})) as span:
+            yield span
+    except Exception:
+        if upstream:
+            UPSTREAM_ERRORS.labels(upstream).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(_handler.get(), name).observe(time.perf_counter() - start)
+        if upstream:
+            UPSTREAM_IN_FLIGHT.labels(upstream).dec()
+
+
+def observe_stage(name: str, seconds: float, **attributes) -> None:
+    """Record a stage timed elsewhere, such as the decode pool's queue wait"""
+    STAGE_SECONDS.labels(_handler.get(), name).observe(seconds)
+    tracing.record_span(name, seconds, **attributes)
+
+
+def upstream_error(service: str) -> None:
+    """Count an upstream failure that was answered rather than raised"""
+    UPSTREAM_ERRORS.labels(service).inc()
+
+
+def clinic_cache_lookup(hit: bool) -> None:
+    CLINIC_CACHE.labels("hit" if hit else "miss").inc()
+
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
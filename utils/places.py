@@ -0,0 +1,166 @@
+"""Nearby clinic search on Google Places, cached by geohash cell"""
+
+from collections import OrderedDict
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from utils import geohash
+from utils.metrics import clinic_cache_lookup, stage, upstream_error
+
+logger = logging.getLogger(__name__)
+
+# Places Nearby Search 允許的最大半徑
+MAX_RADIUS_M = 50_000
+# Nearby Search 一次最多回傳 20 筆，依知名度排序
+PAGE_SIZE = 20
+
+
+class ClinicSearch:
+    """Finds clinics near a point, sharing Places results within a geohash cell.
+
+    Lookups are cached by (geohash cell, radius, keyword). On a miss Places
+    is queried once from the centre of the cell, with the radius widened by
+    the cell's half-diagonal so the result covers every point in the cell.
+    Each lookup then keeps the clinics within `radius` of the user's own
+    location and orders them by true distance. Entries expire after
+    `ttl_seconds`, and at most `max_entries` cells are kept.
+
+    A full page from the cell query may have left out clinics close to the
+    user in favour of more prominent ones further away, so when fewer than
+    `limit` clinics are within `radius` Places is asked again from the
+    user's own location. That answer is not cached.
+    """
+
+    def __init__(
+        self,
+        api_key: str | None,
+        url: str | None = None,
+        precision: int = 6,
+        ttl_seconds: float = 86400,
+        max_entries: int = 1024,
+        limit: int = 5,
+    ):
+        self.api_key = api_key
+        self.url = url or os.getenv(
+            "GOOGLE_PLACES_URL",
+            "https://maps.googleapis.com/maps/api/place/nearbysearch/json",
+        )
+        self.precision = precision
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple, tuple[float, list[dict]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def search(self, lat: float, lng: float, radius: int = 2000, keyword: str = "診所") -> list[dict]:
+        cell = geohash.encode(lat, lng, self.precision)
+        key = (cell, radius, keyword)
+        places = self._get(key)
+        hit = places is not None
+        clinic_cache_lookup(hit)
+        if not hit:
+            center_lat, center_lng = geohash.center(cell)
+            places = self._fetch(
+                center_lat,
+                center_lng,
+                min(radius + int(geohash.cell_radius_m(cell)) + 1, MAX_RADIUS_M),
+                keyword,
+            )
+            if places is None:
+                return []
+            self._put(key, places)
+        logger.info(
+            "Clinic cache %s, hit rate %.0f%% of %d lookups",
+            "hit" if hit else "miss",
+            self.hit_rate * 100,
+            self.hits + self.misses,
+        )
+
+        results = self._within(places, lat, lng, radius)
+        if len(results) < self.limit and len(places) >= PAGE_SIZE:
+            logger.info("Clinic cell results were capped, searching from the user's location")
+            nearby = self._fetch(lat, lng, radius, keyword)
+            if nearby is not None:
+                seen = {(place["name"], place["lat"], place["lng"]) for place in results}
+                results += [
+                    place
+                    for place in self._within(nearby, lat, lng, radius)
+                    if (place["name"], place["lat"], place["lng"]) not in seen
+                ]
+                results.sort(key=lambda place: place["distance"])
+        return results[: self.limit]
+
+    @staticmethod
+    def _within(places: list[dict], lat: float, lng: float, radius: int) -> list[dict]:
+        """The places within `radius` metres of the point, nearest first"""
+        results = []
+        for place in places:
+            distance = geohash.haversine_m(lat, lng, place["lat"], place["lng"])
+            if distance <= radius:
+                results.append({**place, "distance": round(distance)})
+        results.sort(key=lambda place: place["distance"])
+        return results
+
+    def _get(self, key: tuple) -> list[dict] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _put(self, key: tuple, places: list[dict]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, places)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _fetch(self, lat: float, lng: float, radius: int, keyword: str) -> list[dict] | None:
+        """All places Places returns around a point, or None on an API error"""
+        params = {
+            "location": f"{lat},{lng}",
+            "radius": radius,
+            "keyword": keyword,
+            "type": "doctor",
+            "language": "zh-TW",
+            "key": self.api_key,
+        }
+        with stage("places", upstream="google_places"):
+            data = self._session.get(self.url, params=params, timeout=10).json()
+
+        status = data.get("status")
+        if status == "ZERO_RESULTS":
+            return []
+        if status != "OK":
+            # 錯誤結果不快取，下次查詢重試
+            logger.warning("Google Places API error: %s", status)
+            upstream_error("google_places")
+            return None
+
+        return [
+            {
+                "name": place.get("name"),
+                "address": place.get("vicinity"),
+                "lat": place["geometry"]["location"]["lat"],
+                "lng": place["geometry"]["location"]["lng"],
+            }
+            for place in data.get("results", [])
+        ]
@@ -0,0 +1,142 @@
+"""On-demand profiling of a live worker: sampled stacks of all threads, or cProfile per request.
+
+Sampled profiles are written in the collapsed-stack format, one
+`thread;outer;...;inner count` line per distinct stack, which flamegraph.pl,
+speedscope and most flame graph viewers read directly.
+"""
+
+from collections import Counter
+import cProfile
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_SECONDS = 120
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples the stack of every thread every `interval` seconds.
+
+    Only one profile runs at a time; the sampler's own thread is left out.
+    Sampling holds the GIL briefly per tick, so the overhead grows with the
+    number of threads and stack depth rather than with the work being done.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def sample(self, seconds: float) -> Counter:
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        try:
+            return self._sample(min(seconds, MAX_SECONDS))
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float) -> Counter:
+        stacks = Counter()
+        names = {}
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+        return stacks
+
+    def collapsed(self, seconds: float) -> str:
+        """Profile for `seconds` and return the stacks in collapsed format"""
+        stacks = self.sample(seconds)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def write(self, seconds: float, directory: str) -> str:
+        """Profile for `seconds` into a timestamped .folded file, returning its path"""
+        os.makedirs(directory, exist_ok=True)
+        collapsed = self.collapsed(seconds)
+        path = os.path.join(directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(collapsed)
+        return path
+
+
+def install_signal_handler(
+    profiler: SamplingProfiler, seconds: float, directory: str, signum: int | None = None
+) -> bool:
+    """Profile for `seconds` into `directory` whenever the process gets SIGUSR1.
+
+    The profile runs in a background thread, so the signal returns at once.
+    Signal handlers can only be installed from the main thread; returns
+    whether the handler was installed.
+    """
+    signum = signum if signum is not None else getattr(signal, "SIGUSR1", None)
+    if signum is None or threading.current_thread() is not threading.main_thread():
+        return False
+
+    def run():
+        try:
+            path = profiler.write(seconds, directory)
+            logger.info("Wrote %.0fs profile to %s", seconds, path)
+        except ProfilerBusy:
+            logger.warning("Ignoring profile signal, a profile is already running")
+
+    def handle(signum, frame):
+        threading.Thread(target=run, name="signal-profiler", daemon=True).start()
+
+    signal.signal(signum, handle)
+    return True
+
+
+_request_lock = threading.Lock()
+
+
+def profile_request(directory: str, name: str) -> tuple[cProfile.Profile, str]:
+    """Start a cProfile for one request; call finish_request() after it.
+
+    Only one cProfile can be active in a process, so a second request asking
+    for a profile meanwhile gets ProfilerBusy. Since Python 3.12 the profile
+    also counts calls made by other threads while it is active.
+    """
+    if not _request_lock.acquire(blocking=False):
+        raise ProfilerBusy("Another request is being profiled")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        profile = cProfile.Profile()
+        profile.enable()
+    except Exception:
+        _request_lock.release()
+        raise
+    path = os.path.join(directory, f"request-{time.strftime('%Y%m%d-%H%M%S')}-{name}.prof")
+    return profile, path
+
+
+def finish_request(profile: cProfile.Profile, path: str) -> None:
+    """Stop the profile and save it in pstats format, e.g. for snakeviz"""
+    try:
+        profile.disable()
+        profile.dump_stats(path)
+    finally:
+        _request_lock.release()
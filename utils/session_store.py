@@ -0,0 +1,117 @@
+"""Per-user conversation memory with TTL and LRU eviction"""
+
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+import json
+import threading
+import time
+
+SUMMARY_MAX_CHARS = 120
+
+
+@dataclass
+class Turn:
+    question: str
+    summary: str
+    chunk_ids: list[tuple[str, int]]
+    response_type: str
+
+
+@dataclass
+class Session:
+    turns: deque[Turn]
+    updated_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def awaiting_info(self) -> bool:
+        """True when the last answer asked the user for more details"""
+        return bool(self.turns) and self.turns[-1].response_type == "unmatched"
+
+    def summaries(self) -> list[str]:
+        return [turn.summary for turn in self.turns]
+
+    def chunk_ids(self) -> list[tuple[str, int]]:
+        """Chunk ids retrieved in earlier turns, most recent first"""
+        seen = []
+        for turn in reversed(self.turns):
+            for chunk_id in turn.chunk_ids:
+                if chunk_id not in seen:
+                    seen.append(chunk_id)
+        return seen
+
+
+class SessionStore:
+    """Keeps a few compact turns per userId.
+
+    Sessions expire `ttl_seconds` after their last update, each session
+    keeps at most `max_turns` turns, and once `max_sessions` users are
+    tracked the least recently used session is evicted.
+    """
+
+    def __init__(
+        self, ttl_seconds: float = 1800, max_sessions: int = 1000, max_turns: int = 4
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> Session | None:
+        """A copy of the user's session, safe to read while other requests append to it"""
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return None
+            if time.monotonic() - session.updated_at > self.ttl_seconds:
+                del self._sessions[user_id]
+                return None
+            self._sessions.move_to_end(user_id)
+            return Session(turns=deque(session.turns), updated_at=session.updated_at)
+
+    def append(self, user_id: str, turn: Turn) -> None:
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None or time.monotonic() - session.updated_at > self.ttl_seconds:
+                session = Session(turns=deque(maxlen=self.max_turns))
+                self._sessions[user_id] = session
+            session.turns.append(turn)
+            session.updated_at = time.monotonic()
+            self._sessions.move_to_end(user_id)
+
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def clear(self, user_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+def summarize_turn(question: str, gpt_response: str) -> tuple[str, str]:
+    """Build a compact summary of one question/answer pair.
+
+    Returns the summary and the response type ("" if the answer was not JSON).
+    """
+    try:
+        data = json.loads(gpt_response)
+    except (json.JSONDecodeError, TypeError):
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+
+    response_type = str(data.get("type", ""))
+    if response_type == "matched":
+        answer = f"疑似{data.get('disease', '')}"
+    elif response_type == "unmatched":
+        needed = "、".join(str(i) for i in data.get("additional_info_needed", []))
+        answer = f"需補充：{needed}" if needed else str(data.get("message", ""))
+    else:
+        answer = str(data.get("message", ""))
+
+    summary = f"使用者：{question.strip()}｜回覆：{answer}"
+    if len(summary) > SUMMARY_MAX_CHARS:
+        summary = summary[: SUMMARY_MAX_CHARS - 1] + "…"
+    return summary, response_type
@@ -0,0 +1,24 @@
+"""Rough token accounting for prompt budgeting"""
+
+try:
+    import tiktoken
+
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional
+    _ENCODING = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens GPT will see for `text`.
+
+    Uses tiktoken when it is installed. Otherwise counts every non-ASCII
+    character (mostly CJK) as one token and every four ASCII characters
+    as one token, which slightly overestimates Chinese prompts.
+    """
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
@@ -0,0 +1,228 @@
+"""Per-event trace spans, kept in memory for /debug/traces and optionally exported over OTLP"""
+
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Span:
+    name: str
+    span_id: str
+    parent_id: str | None
+    start: float
+    duration: float | None = None
+    attributes: dict = field(default_factory=dict)
+    error: str | None = None
+
+    def set(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self, trace_start: float) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "offset_ms": round((self.start - trace_start) * 1000, 1),
+            "duration_ms": None if self.duration is None else round(self.duration * 1000, 1),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    root: Span
+    spans: list[Span] = field(default_factory=list)
+
+    @property
+    def duration(self) -> float:
+        return self.root.duration or 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "start": self.root.start,
+            "duration_ms": round(self.duration * 1000, 1),
+            "attributes": self.root.attributes,
+            "error": self.root.error,
+            "spans": [span.to_dict(self.root.start) for span in self.spans],
+        }
+
+
+class TraceBuffer:
+    """The most recent `size` traces, for finding the slow ones among them"""
+
+    def __init__(self, size: int = 500):
+        self._traces: deque[Trace] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._traces.maxlen
+
+    def add(self, trace: Trace) -> None:
+        with self._lock:
+            self._traces.append(trace)
+
+    def slowest(self, limit: int = 20) -> list[Trace]:
+        with self._lock:
+            traces = list(self._traces)
+        return sorted(traces, key=lambda trace: trace.duration, reverse=True)[:limit]
+
+
+class OTLPExporter:
+    """Replays finished traces into OpenTelemetry, which batches them to a collector"""
+
+    def __init__(self, endpoint: str, service_name: str = "linebot-voice-assistant"):
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+            from opentelemetry.trace import set_span_in_context
+        except ImportError as e:
+            raise RuntimeError(
+                "OTLP export needs `uv pip install opentelemetry-sdk opentelemetry-exporter-otlp-proto-http`"
+            ) from e
+
+        provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+        provider.add_span_processor(
+            BatchSpanProcessor(OTLPSpanExporter(endpoint=f"{endpoint.rstrip('/')}/v1/traces"))
+        )
+        self.provider = provider
+        self._tracer = provider.get_tracer(__name__)
+        self._set_span_in_context = set_span_in_context
+
+    def export(self, trace: Trace) -> None:
+        exported = {}
+        # 父 span 一定比子 span 早開始，依開始時間建立即可取得父 span
+        for span in sorted([trace.root, *trace.spans], key=lambda span: span.start):
+            parent = exported.get(span.parent_id)
+            attributes = {
+                key: value if isinstance(value, (str, bool, int, float)) else str(value)
+                for key, value in span.attributes.items()
+                if value is not None
+            }
+            if span is trace.root:
+                attributes["linebot.trace_id"] = trace.trace_id
+            otel_span = self._tracer.start_span(
+                span.name,
+                context=self._set_span_in_context(parent) if parent is not None else None,
+                start_time=int(span.start * 1e9),
+                attributes=attributes,
+            )
+            if span.error:
+                otel_span.set_attribute("error", span.error)
+            otel_span.end(end_time=int((span.start + (span.duration or 0)) * 1e9))
+            exported[span.span_id] = otel_span
+
+
+_trace: ContextVar[Trace | None] = ContextVar("trace", default=None)
+_span: ContextVar[Span | None] = ContextVar("span", default=None)
+
+buffer = TraceBuffer()
+_exporter: OTLPExporter | None = None
+
+
+def configure(buffer_size: int = 500, otlp_endpoint: str | None = None) -> None:
+    global buffer, _exporter
+    buffer = TraceBuffer(buffer_size)
+    _exporter = OTLPExporter(otlp_endpoint) if otlp_endpoint else None
+
+
+def _new_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+@contextmanager
+def start_trace(name: str, **attributes):
+    """Trace one webhook event; spans opened inside it are recorded under it"""
+    root = Span(name, _new_id(), None, time.time(), attributes=attributes)
+    trace = Trace(uuid.uuid4().hex, root)
+    trace_token = _trace.set(trace)
+    span_token = _span.set(root)
+    start = time.perf_counter()
+    try:
+        yield trace
+    except Exception as e:
+        root.error = repr(e)
+        raise
+    finally:
+        root.duration = time.perf_counter() - start
+        _span.reset(span_token)
+        _trace.reset(trace_token)
+        buffer.add(trace)
+        if _exporter is not None:
+            try:
+                _exporter.export(trace)
+            except Exception as e:
+                logger.warning("Failed to export trace %s: %s", trace.trace_id, e)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a span under the current one; outside a trace it is not recorded"""
+    trace = _trace.get()
+    parent = _span.get()
+    current = Span(
+        name, _new_id(), parent.span_id if parent else None, time.time(), attributes=attributes
+    )
+    token = _span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except Exception as e:
+        current.error = repr(e)
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        _span.reset(token)
+        if trace is not None:
+            trace.spans.append(current)
+
+
+def record_span(name: str, seconds: float, **attributes) -> None:
+    """Record a span that ended just now after `seconds`, timed elsewhere"""
+    trace = _trace.get()
+    if trace is None:
+        return
+    parent = _span.get()
+    trace.spans.append(
+        Span(
+            name,
+            _new_id(),
+            parent.span_id if parent else None,
+            time.time() - seconds,
+            seconds,
+            attributes,
+        )
+    )
+
+
+def mark_failed(error: Exception) -> None:
+    """Mark the current trace as failed when its error was handled, not raised"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.root.error = repr(error)
+
+
+def set_attribute(key: str, value) -> None:
+    """Attach an attribute to the current span"""
+    current = _span.get()
+    if current is not None:
+        current.set(key, value)
+
+
+def current_trace_id() -> str | None:
+    trace = _trace.get()
+    return trace.trace_id if trace else None
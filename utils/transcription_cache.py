@@ -0,0 +1,107 @@
+"""Transcription cache keyed by the decoded audio content"""
+
+from collections import OrderedDict
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+import speech_recognition as sr
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptionCache:
+    """LRU cache of transcripts for forwarded or redelivered voice messages.
+
+    Keys hash the decoded PCM together with the ASR backend and language, so
+    a forwarded or redelivered clip hits whenever it decodes to the same
+    samples, while switching backends does not return stale text. Stored
+    transcripts are returned as they are. At most `max_entries` transcripts are kept
+    in memory. With `path` set they are also stored in SQLite, bounded to
+    the same number of most recently used rows, and survive restarts.
+    """
+
+    def __init__(self, max_entries: int = 1024, path: str | None = None):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS transcriptions "
+                "(key TEXT PRIMARY KEY, text TEXT NOT NULL, used REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def key(audio: sr.AudioData, backend: str, language: str) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{backend}\0{language}\0{audio.sample_rate}\0".encode())
+        digest.update(audio.frame_data)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            elif self._db is not None:
+                text = self._load(key)
+
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return text
+
+    def _load(self, key: str) -> str | None:
+        """Read a transcript from SQLite; a database error counts as a miss"""
+        try:
+            row = self._db.execute(
+                "SELECT text FROM transcriptions WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Failed to read cached transcription: %s", e)
+            return None
+        if row is None:
+            return None
+        text = row[0]
+        self._remember(key, text)
+        try:
+            self._db.execute(
+                "UPDATE transcriptions SET used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning("Failed to update cached transcription: %s", e)
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        with self._lock:
+            self._remember(key, text)
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO transcriptions (key, text, used) VALUES (?, ?, ?)",
+                    (key, text, time.time()),
+                )
+                self._db.execute(
+                    "DELETE FROM transcriptions WHERE key NOT IN "
+                    "(SELECT key FROM transcriptions ORDER BY used DESC LIMIT ?)",
+                    (self.max_entries,),
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning("Failed to persist transcription: %s", e)
+
+    def _remember(self, key: str, text: str) -> None:
+        self._entries[key] = text
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,66 @@
+"""Token usage and latency accounting for GPT calls"""
+
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class UsageRecorder:
+    """Keeps running totals of GPT token usage.
+
+    When `log_path` is set every call is also appended to it as one JSON
+    line, so cost and latency can be tracked over time.
+    """
+
+    def __init__(self, log_path: str | None = None):
+        self.log_path = log_path
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, model: str, usage, latency: float) -> dict:
+        """Record the `usage` object of a chat completion response"""
+        details = getattr(usage, "prompt_tokens_details", None)
+        entry = {
+            "ts": round(time.time(), 3),
+            "model": model,
+            "prompt_tokens": usage.prompt_tokens if usage else 0,
+            "cached_tokens": (getattr(details, "cached_tokens", None) or 0),
+            "completion_tokens": usage.completion_tokens if usage else 0,
+            "latency_ms": round(latency * 1000, 1),
+        }
+
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += entry["prompt_tokens"]
+            self.cached_tokens += entry["cached_tokens"]
+            self.completion_tokens += entry["completion_tokens"]
+            if self.log_path:
+                try:
+                    with open(self.log_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(entry) + "\n")
+                except OSError as e:
+                    logger.warning("Failed to write usage log: %s", e)
+
+        logger.info(
+            "GPT usage: prompt=%d cached=%d completion=%d latency=%sms",
+            entry["prompt_tokens"],
+            entry["cached_tokens"],
+            entry["completion_tokens"],
+            entry["latency_ms"],
+        )
+        return entry
+
+    def totals(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "completion_tokens": self.completion_tokens,
+            }